@@ -1,24 +1,106 @@
-from constants import CARD_NAMES
+import numpy as np
+import pandas as pd
 
-def allocate(invoice_no, cust_po, charges, grower_split, company, invoice_date, mapping_df):
-    """Returns (rows: list[dict], fail_reason: str|None)"""
+import metrics
+from constants import CARD_NAMES, EXPORT_COLUMNS
+from exporter import group_with_blank_lines
+from records import AllocationLine
+
+NO_CHARGES_REASON = "No charge lines found (Logistics/Freight) on invoice"
+
+
+def _supplier_key(name) -> str:
+    return str(name).strip().lower()
+
+
+def _comparable(value):
+    return tuple(None if pd.isna(v) else v for v in value)
+
+
+class AccountMap:
+    """Account Maps workbook indexed as normalized supplier -> (logistics acc, freight acc, job code).
+
+    Built once per workbook. Suppliers listed more than once with different accounts
+    raise ValueError here instead of silently using the first row.
+    """
+
+    def __init__(self, mapping_df: pd.DataFrame):
+        self._accounts = {}
+        conflicts = {}
+        cols = [mapping_df[c] for c in ("Supplier", "Logistics Account", "Freight Account", "Job Code")]
+        for supplier, logistics_acc, freight_acc, job_code in zip(*cols):
+            if not isinstance(supplier, str):
+                continue  # blank supplier cells never matched a grower
+            key = _supplier_key(supplier)
+            value = (logistics_acc, freight_acc, job_code)
+            seen = self._accounts.setdefault(key, value)
+            if _comparable(seen) != _comparable(value):
+                conflicts.setdefault(key, [seen]).append(value)
+        if conflicts:
+            detail = "; ".join(f"{k}: {', '.join(map(str, v))}" for k, v in conflicts.items())
+            raise ValueError(f"Conflicting account mappings for suppliers: {detail}")
+
+    @classmethod
+    def from_excel(cls, excel_file) -> "AccountMap":
+        if hasattr(excel_file, "seek"):
+            excel_file.seek(0)
+        return cls(pd.read_excel(excel_file))
+
+    def get(self, grower):
+        """(logistics_acc, freight_acc, job_code) or None if the grower is unmapped."""
+        return self._accounts.get(_supplier_key(grower))
+
+    def __contains__(self, grower) -> bool:
+        return _supplier_key(grower) in self._accounts
+
+    def __len__(self) -> int:
+        return len(self._accounts)
+
+
+def _normalized(pcts) -> list:
+    """Shares scaled to sum to 1, so only rounding cents are left over."""
+    pcts = list(pcts)
+    total = sum(pcts)
+    return [p / total for p in pcts] if total else pcts
+
+
+def split_cents(amount: float, pcts) -> list:
+    """Splits `amount` by `pcts` (normalized) in whole cents; the residual cent(s) go to the
+       largest share so the parts always sum to the rounded charge total.
+    """
+    pcts = _normalized(pcts)
+    if not pcts:
+        return []
+    cents = [round(amount * p * 100) for p in pcts]
+    largest = max(range(len(pcts)), key=lambda i: (pcts[i], -i))
+    cents[largest] += round(amount * 100) - sum(cents)
+    return [c / 100 for c in cents]
+
+
+@metrics.timed("allocate")
+def allocate(invoice_no, cust_po, charges, grower_split, company, invoice_date, account_map):
+    """Returns (lines: list[AllocationLine], fail_reason: str|None)
+       `account_map` is an AccountMap (a raw mapping DataFrame is indexed on the fly).
+    """
+    if not isinstance(account_map, AccountMap):
+        account_map = AccountMap(account_map)
     rows = []
     card_name = CARD_NAMES.get(company, company)
 
     # Fail if any growers unmapped
-    missing = []
-    for grower in grower_split.keys():
-        hit = mapping_df[mapping_df["Supplier"].str.strip().str.lower() == grower.strip().lower()]
-        if hit.empty: missing.append(grower)
+    metrics.incr("mapping_lookups", len(grower_split))
+    missing = [grower for grower in grower_split.keys() if grower not in account_map]
     if missing:
         return [], f"No account mapping found for growers: {', '.join(missing)}"
+    if not grower_split:
+        return [], NO_CHARGES_REASON
+
+    # Cent-exact share of every charge, per grower
+    shares = {ch_type: split_cents(amount, grower_split.values()) for ch_type, amount in charges.items()}
 
     # Build rows
-    for grower, pct in grower_split.items():
-        row = mapping_df[mapping_df["Supplier"].str.strip().str.lower() == grower.strip().lower()]
-        logistics_acc = row["Logistics Account"].values[0]
-        freight_acc   = row["Freight Account"].values[0]
-        job_code      = row["Job Code"].values[0]
+    for g, (grower, pct) in enumerate(grower_split.items()):
+        logistics_acc, freight_acc, job_code = account_map.get(grower)
 
         for ch_type, amount in charges.items():
             if ch_type == "Logistics":
@@ -29,19 +111,86 @@ def allocate(invoice_no, cust_po, charges, grower_split, company, invoice_date,
                 account_no = freight_acc
                 desc = f"Blueberry Freight {job_code}"
 
-            rows.append({
-                "Co./Last Name": card_name,
-                "Date": invoice_date,
-                "Supplier Invoice No.": invoice_no,
-                "Description": desc,
-                "Account No.": account_no,
-                "Amount": round(amount * pct, 2),
-                "Job": job_code,
-                "Tax Code": "GST",
-                "Comment": cust_po
-            })
+            rows.append(AllocationLine(card_name, invoice_date, invoice_no, desc, account_no,
+                                       shares[ch_type][g], job_code, "GST", cust_po))
 
     if not rows:
-        return [], "No charge lines found (Logistics/Freight) on invoice"
+        return [], NO_CHARGES_REASON
 
     return rows, None
+
+
+@metrics.timed("allocate_batch")
+def allocate_batch(invoices, account_map):
+    """Vectorized allocate() over many invoices at once.
+
+    `invoices` is a sequence of dicts with allocate()'s arguments (invoice_no, cust_po,
+    charges, grower_split, company, invoice_date). Returns (export_df, failures) where
+    export_df is the MYOB frame with a blank line after each invoice (as
+    exporter.group_with_blank_lines) and failures maps invoice position -> fail reason.
+    """
+    if not isinstance(account_map, AccountMap):
+        account_map = AccountMap(account_map)
+    failures = {}
+
+    # Explode to one entry per (invoice, grower) and per (invoice, charge)
+    g_inv, g_pos, g_pct, g_log, g_frt, g_job = [], [], [], [], [], []
+    c_inv, c_pos, c_type, c_amt = [], [], [], []
+    for i, inv in enumerate(invoices):
+        split, charges = inv["grower_split"], inv["charges"]
+        metrics.incr("mapping_lookups", len(split))
+        missing = [grower for grower in split if grower not in account_map]
+        if missing:
+            failures[i] = f"No account mapping found for growers: {', '.join(missing)}"
+            continue
+        if not split or not charges:
+            failures[i] = NO_CHARGES_REASON
+            continue
+        for pos, (grower, pct) in enumerate(zip(split, _normalized(split.values()))):
+            logistics_acc, freight_acc, job_code = account_map.get(grower)
+            g_inv.append(i); g_pos.append(pos); g_pct.append(pct)
+            g_log.append(logistics_acc); g_frt.append(freight_acc); g_job.append(job_code)
+        for pos, (ch_type, amount) in enumerate(charges.items()):
+            c_inv.append(i); c_pos.append(pos); c_type.append(ch_type); c_amt.append(amount)
+
+    if not g_inv:
+        return pd.DataFrame(columns=EXPORT_COLUMNS), failures
+
+    growers = pd.DataFrame({"inv": g_inv, "g_pos": g_pos, "pct": g_pct,
+                            "log_acc": g_log, "frt_acc": g_frt, "job": g_job})
+    lines = growers.merge(pd.DataFrame({"inv": c_inv, "c_pos": c_pos, "ch_type": c_type, "charge": c_amt}),
+                          on="inv", how="inner")
+    lines = lines.sort_values(["inv", "g_pos", "c_pos"], kind="stable").reset_index(drop=True)
+
+    # Cent-exact amounts: residual cents of each (invoice, charge) go to its largest share
+    charge = lines["charge"].to_numpy(dtype=float)
+    pct = lines["pct"].to_numpy(dtype=float)
+    cents = np.round(charge * pct * 100)
+    by_charge = [lines["inv"], lines["c_pos"]]
+    residual = np.round(charge * 100) - pd.Series(cents).groupby(by_charge).transform("sum").to_numpy()
+    largest = lines["pct"].groupby(by_charge, sort=False).idxmax().to_numpy()
+    cents[largest] += residual[largest]
+
+    is_logistics = (lines["ch_type"] == "Logistics").to_numpy()
+    job = lines["job"].map(str)
+    trays = pd.Series(np.round(charge / 0.85).astype(np.int64)).map(str)
+    desc = np.where(is_logistics, (trays + " x Blueberry Logistics " + job).to_numpy(dtype=object),
+                    ("Blueberry Freight " + job).to_numpy(dtype=object))
+
+    inv_cols = pd.DataFrame([(CARD_NAMES.get(inv["company"], inv["company"]), inv["invoice_date"],
+                              inv["invoice_no"], inv["cust_po"]) for inv in invoices],
+                            columns=["card", "date", "invoice_no", "cust_po"])
+    idx = lines["inv"].to_numpy()
+    export = pd.DataFrame({
+        "Co./Last Name": inv_cols["card"].to_numpy(dtype=object)[idx],
+        "Date": inv_cols["date"].to_numpy(dtype=object)[idx],
+        "Supplier Invoice No.": inv_cols["invoice_no"].to_numpy(dtype=object)[idx],
+        "Description": desc,
+        "Account No.": np.where(is_logistics, lines["log_acc"].to_numpy(dtype=object),
+                                lines["frt_acc"].to_numpy(dtype=object)),
+        "Amount": cents / 100,
+        "Job": lines["job"].to_numpy(dtype=object),
+        "Tax Code": "GST",
+        "Comment": inv_cols["cust_po"].to_numpy(dtype=object)[idx],
+    }).infer_objects()
+    return group_with_blank_lines(export, "Supplier Invoice No."), failures
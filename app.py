@@ -1,9 +1,18 @@
+import os
+import time
+
 import streamlit as st
 import pandas as pd
-from parsers import parse_pdf_filelike
+import metrics
 from excel_ops import get_grower_split
 from allocator import allocate
-from exporter import group_with_blank_lines, to_tab_delimited_with_header
+from exporter import EXPORT_COLUMNS
+from ledger import Ledger
+from pipeline import assemble_batch, iter_batch, process_invoice
+from reconcile import Rules, approve, propose
+from records import FailReason
+from shared_cache import SharedCache
+from watcher import ReviewQueue
 
 st.title("Invoice Splitter for MYOB")
 
@@ -11,107 +20,206 @@ uploaded_pdfs   = st.file_uploader("Upload Invoice PDFs", type="pdf", accept_mul
 uploaded_excel  = st.file_uploader("Upload Consignment Summary Excel", type=["xlsx"])
 uploaded_maps   = st.file_uploader("Upload Account Maps Excel", type=["xlsx"])
 
-if "failed_payloads" not in st.session_state:
-    st.session_state.failed_payloads = {}
+# Invoices the watch-folder daemon (python -m watcher) could not export, opened instead of uploads
+review_queue = ReviewQueue(os.environ["INVOICESPLIT_REVIEW_QUEUE"]) if os.environ.get("INVOICESPLIT_REVIEW_QUEUE") else None
+queued = review_queue.items() if review_queue else []
+if queued and st.sidebar.checkbox(f"Open the review queue ({len(queued)} invoices)", key="open_review_queue"):
+    uploaded_pdfs = queued
+    if not (uploaded_excel and uploaded_maps) and review_queue.workbooks():
+        uploaded_excel, uploaded_maps = review_queue.workbooks()  # the daemon's workbooks
+else:
+    review_queue = None
 
-def _mk_key(company, invoice_no, cust_po):
-    return f"{str(company).strip()}|{str(invoice_no).strip()}|{str(cust_po).strip()}"
 
-if uploaded_pdfs and uploaded_excel and uploaded_maps:
-    mapping_df = pd.read_excel(uploaded_maps)
-    all_rows, failed_rows, stash = [], [], {}
-
-    for pdf in uploaded_pdfs:
-        company, (invoice_no, cust_po, invoice_date, charges, invoice_trays) = parse_pdf_filelike(pdf)
-
-        # Fail 1: missing PO
-        if not cust_po:
-            key = _mk_key(company, invoice_no, cust_po or "")
-            stash[key] = dict(company=company, invoice_no=invoice_no, cust_po=cust_po,
-                              invoice_date=invoice_date, charges=charges,
-                              pdf_trays=invoice_trays)  # keep pdf_trays if we extracted a number
-            failed_rows.append({"Company": company, "Invoice No.": invoice_no, "PO No.": cust_po,
-                                "Reason": f"Could not read PO from {pdf.name}", "Key": key})
-            continue
-
-        grower_split, excel_trays = get_grower_split(uploaded_excel, cust_po, company)
-
-        # Fail 2: no growers (often because consignment trays are zero/missing)
-        if not grower_split:
-            key = _mk_key(company, invoice_no, cust_po)
-            stash[key] = dict(company=company, invoice_no=invoice_no, cust_po=cust_po,
-                              invoice_date=invoice_date, charges=charges,
-                              pdf_trays=invoice_trays, cons_trays=excel_trays)
-            failed_rows.append({"Company": company, "Invoice No.": invoice_no, "PO No.": cust_po,
-                                "Reason": f"No growers found in Consignment Summary for PO {cust_po}",
-                                "Key": key})
-            continue
-
-        inv_ok = isinstance(invoice_trays, (int, float)) and invoice_trays > 0
-        ex_ok  = isinstance(excel_trays, (int, float)) and excel_trays > 0
-
-        # Fail 3: invoice trays missing -> stash for manual tray fix
-        if not inv_ok:
-            key = _mk_key(company, invoice_no, cust_po)
-            stash[key] = dict(company=company, invoice_no=invoice_no, cust_po=cust_po,
-                              invoice_date=invoice_date, charges=charges,
-                              grower_split=grower_split, cons_trays=excel_trays)
-            failed_rows.append({"Company": company, "Invoice No.": invoice_no, "PO No.": cust_po,
-                                "Reason": "Could not determine tray count on the invoice", "Key": key})
-            continue
-
-        # Fail 4: consignment trays missing
-        if not ex_ok:
-            key = _mk_key(company, invoice_no, cust_po)
-            stash[key] = dict(company=company, invoice_no=invoice_no, cust_po=cust_po,
-                              invoice_date=invoice_date, charges=charges,
-                              pdf_trays=invoice_trays, cons_trays=excel_trays)
-            failed_rows.append({"Company": company, "Invoice No.": invoice_no, "PO No.": cust_po,
-                                "Reason": "Consignment Summary tray total is missing/zero", "Key": key})
-            continue
-
-        # Fail 5: tray mismatch
-        if int(round(invoice_trays)) != int(round(excel_trays)):
-            key = _mk_key(company, invoice_no, cust_po)
-            stash[key] = dict(company=company, invoice_no=invoice_no, cust_po=cust_po,
-                              invoice_date=invoice_date, charges=charges,
-                              pdf_trays=invoice_trays, cons_trays=excel_trays)
-            failed_rows.append({"Company": company, "Invoice No.": invoice_no, "PO No.": cust_po,
-                                "Reason": f"Tray mismatch: Invoice has {int(round(invoice_trays))}, "
-                                          f"Consignment has {int(round(excel_trays))}",
-                                "Key": key})
-            continue
-
-        # Allocation (may fail 6: missing mapping)
-        rows, fail_reason = allocate(invoice_no, cust_po, charges, grower_split, company, invoice_date, mapping_df)
+@st.cache_resource
+def shared_resources() -> SharedCache:
+    """Workbook indexes shared by every session on this server, built once per file content."""
+    return SharedCache()
+
+
+@st.cache_resource
+def export_ledger() -> Ledger:
+    """The export ledger, opened once and shared by every session on this server."""
+    return Ledger()
+
+
+def _upload_id(f):
+    if isinstance(f, str):  # workbook path from the review queue
+        return f, os.path.getmtime(f)
+    return getattr(f, "file_id", None) or (f.name, f.size)
+
+
+def _resolve(key, lines):
+    """Fold a fixed invoice into the session's batch and rerun to refresh the tables."""
+    st.session_state.batch.resolve(key, lines)
+    st.session_state.fixed_message = f"Invoice {lines[0].invoice_no} added to the MYOB import file."
+    st.rerun()
+
+
+def _reprocess_with_po(key, failure, new_po):
+    """Re-run matching + allocation for a failed invoice with a corrected PO."""
+    cons_index, account_map = st.session_state.cons_index, st.session_state.account_map
+    grower_split, excel_trays = get_grower_split(cons_index, new_po, failure.company)
+    if not grower_split:
+        st.error("Still no growers found for this PO.")
+        return
+    inv_trays = failure.pdf_trays
+    inv_ok = isinstance(inv_trays, (int, float)) and inv_trays > 0
+    if not inv_ok:
+        st.error("The invoice tray count is unreadable. Use the tray fix mode.")
+    elif int(round(inv_trays)) != int(round(excel_trays)):
+        st.error(f"Tray mismatch: Invoice has {int(round(inv_trays))}, Consignment has {int(round(excel_trays))}.")
+    else:
+        lines, fail_reason = allocate(
+            failure.invoice_no, new_po, failure.charges,
+            grower_split, failure.company, failure.invoice_date, account_map
+        )
         if fail_reason:
-            key = _mk_key(company, invoice_no, cust_po)
-            stash[key] = dict(company=company, invoice_no=invoice_no, cust_po=cust_po,
-                              invoice_date=invoice_date, charges=charges)
-            failed_rows.append({"Company": company, "Invoice No.": invoice_no, "PO No.": cust_po,
-                                "Reason": fail_reason, "Key": key})
-            continue
-        all_rows.extend(rows)
+            st.error(f"Still failing: {fail_reason}")
+        else:
+            _resolve(key, lines)
+
+
+def _po_suggestions(key, failure, query):
+    """Closest Consignment Summary POs for `query` (same company's consignors), one click to apply."""
+    candidates = st.session_state.cons_index.suggest(query, failure.company)
+    if not candidates:
+        st.caption(f"No similar POs found in the Consignment Summary for {query}.")
+        return
+    pdf_trays = failure.pdf_trays
+
+    def label(c):
+        trays = int(round(c["trays"]))
+        match = " ✓ trays match" if pdf_trays and trays == int(round(pdf_trays)) else ""
+        return f"{c['po']} — {trays} trays, {c['growers']} grower(s){match}"
+
+    choice = st.radio(f"Closest POs to {query} in the Consignment Summary", candidates,
+                      format_func=label, key=f"po_suggest_{key}")
+    if st.button(f"Reprocess with {choice['po']}", key=f"po_suggest_go_{key}"):
+        _reprocess_with_po(key, failure, choice["po"])
+
 
-    st.session_state.failed_payloads = stash
+def _record_export():
+    """Download callback: record what was just downloaded, once per change to the batch."""
+    batch = st.session_state.batch
+    if st.session_state.get("recorded_count") == len(batch.exported):
+        return
+    export_id = batch.record(export_ledger(), label="myob_import.txt")
+    st.session_state.recorded_count = len(batch.exported)
+    if st.session_state.get("review_queue"):
+        st.session_state.review_queue.remove(batch.invoices[k]["source"] for k in batch.exported)
+    st.session_state.fixed_message = f"Recorded as export #{export_id}; re-uploading these invoices will flag them."
+
+
+if uploaded_pdfs and uploaded_excel and uploaded_maps:
+    # Parse + allocate only when the uploads change; fix-panel reruns reuse the session's batch
+    upload_sig = (tuple(_upload_id(f) for f in uploaded_pdfs), _upload_id(uploaded_excel), _upload_id(uploaded_maps))
+    if st.session_state.get("upload_sig") != upload_sig:
+        # this batch's numbers only, collected apart from any other session's
+        with metrics.collect() as batch_metrics:
+            sources = [pdf.name for pdf in uploaded_pdfs]
+            hashes = [None] * len(sources)  # filled in by iter_batch as each upload is read
+            progress = st.progress(0.0, text="Reading invoices...")
+            live = st.empty()
+            results, done_rows, shown_at, loaded = [], [], 0.0, {}
+            try:
+                # invoices stream in as they finish; workbooks load alongside the first extractions
+                for result in iter_batch(uploaded_pdfs, sources, uploaded_excel, uploaded_maps, loaded=loaded,
+                                         ledger=export_ledger(), hashes=hashes, shared=shared_resources()):
+                    results.append(result)
+                    done_rows.extend(result[2])
+                    progress.progress(len(results) / len(sources), text=f"{len(results)}/{len(sources)} invoices processed")
+                    if done_rows and time.monotonic() - shown_at > 0.5:  # redraw at most twice a second
+                        live.dataframe(pd.DataFrame(done_rows, columns=EXPORT_COLUMNS))
+                        shown_at = time.monotonic()
+            except ValueError as e:  # e.g. conflicting account mappings
+                st.error(str(e))
+                st.stop()
+        progress.empty()
+        live.empty()
+
+        st.session_state.batch = assemble_batch(results, sources, hashes)
+        st.session_state.recorded_count = None
+        st.session_state.cons_index = loaded["cons_index"]
+        st.session_state.account_map = loaded["account_map"]
+        st.session_state.leases = loaded["leases"]  # the previous uploads' leases are released here
+        st.session_state.metrics = batch_metrics.snapshot()
+        st.session_state.review_queue = review_queue  # exported invoices leave the queue
+        st.session_state.upload_sig = upload_sig
+
+    batch = st.session_state.batch
+    cons_index = st.session_state.cons_index
+    account_map = st.session_state.account_map
+    failed_rows = batch.failed_rows
+
+    if "fixed_message" in st.session_state:
+        st.success(st.session_state.pop("fixed_message"))
 
     # Success table + download
-    if all_rows:
-        df_out = pd.DataFrame(all_rows)
-        df_export = group_with_blank_lines(df_out, "Supplier Invoice No.")
+    if batch.line_count:
+        df_export = batch.export_frame()
         st.subheader("Processed Invoices")
         st.dataframe(df_export)
-        txt = to_tab_delimited_with_header(df_export)
-        st.download_button("Download MYOB Import File", txt, "myob_import.txt", "text/plain")
+        txt = batch.export_text()
+        st.download_button("Download MYOB Import File", txt, "myob_import.txt", "text/plain",
+                           on_click=_record_export)
     else:
         st.info("No invoices were successfully processed.")
 
+    with st.expander("Previous exports"):
+        ledger = export_ledger()
+        exports = ledger.exports()
+        if exports:
+            choice = st.selectbox("Export", exports, format_func=lambda e: f"#{e['id']} — {e['created_at']} "
+                                                                      f"({e['invoices']} invoices)")
+            st.download_button("Download again", ledger.export_text(choice["id"]),
+                               f"myob_import_{choice['id']}.txt", "text/plain")
+        else:
+            st.caption("No exports recorded yet.")
+
+    with st.expander("Performance"):
+        snap = st.session_state.metrics
+        st.dataframe(pd.DataFrame([{"Stage": k, "Calls": t["calls"], "Seconds": t["seconds"]}
+                                   for k, t in snap["timers"].items()]))
+        st.dataframe(pd.DataFrame([{"Counter": k, "Value": v} for k, v in snap["counters"].items()]))
+        shared = shared_resources()
+        st.caption(f"Shared workbook cache (all sessions), budget {shared.budget / 2**20:.0f} MiB:")
+        st.dataframe(pd.DataFrame(shared.stats()))
+
     # -------------------- Dynamic single fix panel --------------------
     if failed_rows:
         st.subheader("Failed Invoices (with reasons)")
         failed_df = pd.DataFrame(failed_rows)
         st.dataframe(failed_df)
 
+        # Tray mismatches: proposed splits for all of them, approved in one go
+        mismatches = [f for f in batch.failures if f.reason is FailReason.TRAY_MISMATCH]
+        if mismatches:
+            st.markdown("### Auto-resolve tray mismatches")
+            col_trays, col_pct = st.columns(2)
+            max_trays = col_trays.number_input("Split proportionally when off by at most (trays)",
+                                               min_value=0, value=2, step=1)
+            max_pct = col_pct.number_input("... or by at most (% of consignment trays)",
+                                           min_value=0.0, value=1.0, step=0.5)
+            proposals = propose(mismatches, cons_index, Rules(max_trays=max_trays, max_pct=max_pct / 100))
+            if proposals:
+                by_key = {f.key: f for f in mismatches}
+                table = pd.DataFrame([{"Approve": True, "Company": by_key[p.key].company,
+                                       "Invoice No.": by_key[p.key].invoice_no, "PO No.": by_key[p.key].cust_po,
+                                       "Proposal": p.detail} for p in proposals])
+                edited = st.data_editor(table, hide_index=True, key=f"auto_resolve_{len(batch.fixed)}",
+                                        disabled=[c for c in table.columns if c != "Approve"])
+                approved = [p for p, ok in zip(proposals, edited["Approve"]) if ok]
+                if st.button(f"Approve {len(approved)} of {len(mismatches)} mismatches", disabled=not approved):
+                    rejected = approve(batch, approved, account_map)
+                    message = f"{len(approved) - len(rejected)} tray mismatches resolved and added to the MYOB import file."
+                    if rejected:
+                        message += " Still failing: " + "; ".join(rejected.values())
+                    st.session_state.fixed_message = message
+                    st.rerun()
+            else:
+                st.caption("No proposals for the current mismatches under these rules; fix them below.")
+
         st.markdown("### Fix & Reprocess (dynamic form)")
         # Choose any failed invoice
         labels = {
@@ -121,71 +229,62 @@ if uploaded_pdfs and uploaded_excel and uploaded_maps:
         if labels:
             label_sel = st.selectbox("Choose an invoice to fix:", list(labels.keys()))
             key = labels[label_sel]
-            payload = st.session_state.failed_payloads.get(key, {})
-            reason = next((r["Reason"] for r in failed_rows if r.get("Key")==key), "").lower()
+            failure = batch.failure(key)
+
+            # 0) Already exported
+            if failure.reason is FailReason.DUPLICATE:
+                st.warning("This invoice is already in a recorded MYOB export. Only export it again if the "
+                           "earlier import was rolled back.")
+                if st.button("Process and export again"):
+                    lines, still_failed = process_invoice(failure.company, failure.parsed(), cons_index, account_map)
+                    if still_failed:
+                        st.error(f"Still failing: {still_failed.message}")
+                    else:
+                        _resolve(key, lines)
 
             # 1) Missing PO
-            if "could not read po" in reason:
+            elif failure.reason is FailReason.MISSING_PO:
                 new_po = st.text_input("Enter PO (e.g., OZG12345)")
                 if st.button("Reprocess with this PO"):
                     if not new_po.strip():
                         st.error("Please enter a PO.")
                     else:
-                        # Re-run the normal pipeline with the new PO
-                        grower_split, excel_trays = get_grower_split(uploaded_excel, new_po.strip(), payload["company"])
-                        if not grower_split:
-                            st.error("Still no growers found for this PO.")
-                        else:
-                            inv_trays = payload.get("pdf_trays")
-                            inv_ok = isinstance(inv_trays, (int, float)) and inv_trays > 0
-                            if not inv_ok:
-                                st.error("The invoice tray count is unreadable. Use the tray fix mode.")
-                            elif int(round(inv_trays)) != int(round(excel_trays)):
-                                st.error(f"Tray mismatch: Invoice has {int(round(inv_trays))}, Consignment has {int(round(excel_trays))}.")
-                            else:
-                                rows, fail_reason = allocate(
-                                    payload["invoice_no"], new_po.strip(), payload["charges"],
-                                    grower_split, payload["company"], payload["invoice_date"], mapping_df
-                                )
-                                if fail_reason:
-                                    st.error(f"Still failing: {fail_reason}")
-                                else:
-                                    df_fix = pd.DataFrame(rows)
-                                    df_fix_exp = group_with_blank_lines(df_fix, "Supplier Invoice No.")
-                                    st.subheader("Reprocessed Invoice")
-                                    st.dataframe(df_fix_exp)
-                                    txt2 = to_tab_delimited_with_header(df_fix_exp)
-                                    st.download_button("Download MYOB Import (This Invoice Only)",
-                                                       txt2, f"myob_import_{payload['invoice_no']}.txt", "text/plain")
+                        _reprocess_with_po(key, failure, new_po.strip())
+                if new_po.strip():
+                    _po_suggestions(key, failure, new_po.strip())
+
+            # Unreadable PDF, or the watch-folder daemon could not process it
+            elif failure.reason is FailReason.ERROR:
+                st.error(failure.message)
+                st.caption("Nothing was read from this PDF, so there is nothing to correct here. "
+                           "Check the file (re-save or re-scan it) and upload it again.")
 
             # 2) Unreadable trays on PDF
-            elif "determine tray count" in reason:
-                cons_trays = int(round(payload.get("cons_trays", payload.get("excel_trays", 0)) or 0))
+            elif failure.reason is FailReason.INVOICE_TRAYS_MISSING:
+                cons_trays = int(round(failure.cons_trays or 0))
                 tray_override = st.number_input(f"Enter tray count seen on the invoice (must equal consignment trays = {cons_trays})",
                                                 min_value=1, step=1)
                 if st.button("Reprocess with this tray count"):
                     if tray_override != cons_trays:
                         st.error(f"Tray mismatch with Consignment: override {tray_override} vs {cons_trays}")
                     else:
-                        rows, fail_reason = allocate(
-                            payload["invoice_no"], payload["cust_po"], payload["charges"],
-                            payload.get("grower_split", {}), payload["company"], payload["invoice_date"],
-                            mapping_df
+                        lines, fail_reason = allocate(
+                            failure.invoice_no, failure.cust_po, failure.charges,
+                            failure.grower_split or {}, failure.company, failure.invoice_date,
+                            account_map
                         )
                         if fail_reason:
                             st.error(f"Still failing: {fail_reason}")
                         else:
-                            df_fix = pd.DataFrame(rows)
-                            df_fix_exp = group_with_blank_lines(df_fix, "Supplier Invoice No.")
-                            st.subheader("Reprocessed Invoice")
-                            st.dataframe(df_fix_exp)
-                            txt2 = to_tab_delimited_with_header(df_fix_exp)
-                            st.download_button("Download MYOB Import (This Invoice Only)",
-                                               txt2, f"myob_import_{payload['invoice_no']}.txt", "text/plain")
+                            _resolve(key, lines)
 
             # 3) Tray mismatch OR no growers / consignment zero
             else:
-                pdf_trays = int(round(payload.get("pdf_trays") or 0))
+                if failure.reason is FailReason.NO_GROWERS:
+                    _po_suggestions(key, failure, failure.cust_po)
+                    st.markdown("**Or enter the supplier split manually:**")
+
+                pdf_trays = int(round(failure.pdf_trays or 0))
                 st.caption(f"PDF tray count detected: {pdf_trays if pdf_trays else 'not detected'}")
                 if pdf_trays <= 0:
                     pdf_trays = st.number_input("Enter total tray count for this invoice (from PDF)", min_value=1, step=1)
@@ -216,16 +315,10 @@ if uploaded_pdfs and uploaded_excel and uploaded_maps:
                             # Convert entered trays to percentages
                             split_override = {name: qty / total_entered for name, qty in splits_raw}
                             rows_ng, fail_reason_ng = allocate(
-                                payload["invoice_no"], payload["cust_po"], payload["charges"],
-                                split_override, payload["company"], payload["invoice_date"], mapping_df
+                                failure.invoice_no, failure.cust_po, failure.charges,
+                                split_override, failure.company, failure.invoice_date, account_map
                             )
                             if fail_reason_ng:
                                 st.error(f"Still failing: {fail_reason_ng}")
                             else:
-                                df_fix_ng = pd.DataFrame(rows_ng)
-                                df_fix_ng_exp = group_with_blank_lines(df_fix_ng, "Supplier Invoice No.")
-                                st.subheader("Reprocessed Invoice (Manual Split)")
-                                st.dataframe(df_fix_ng_exp)
-                                txt_ng = to_tab_delimited_with_header(df_fix_ng_exp)
-                                st.download_button("Download MYOB Import (This Invoice Only)",
-                                                   txt_ng, f"myob_import_{payload['invoice_no']}.txt", "text/plain")
+                                _resolve(key, rows_ng)
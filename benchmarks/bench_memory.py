@@ -0,0 +1,69 @@
+"""Retained memory per invoice for parsed invoices, allocation lines and failure records.
+
+    python -m benchmarks.bench_memory --invoices 5000
+
+Builds parsed invoices straight from synth specs (no PDF extraction), runs each through
+pipeline.process_invoice and keeps every result alive, as the app's batch state does.
+About a quarter of the invoices are made to fail (missing PO or tray mismatch).
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+
+from benchmarks.synth import synth_batch
+from benchmarks.workbooks import consignment_frame, maps_frame
+from records import ParsedInvoice
+
+
+def parsed_from_spec(spec, rng):
+    trays = sum(spec["trays"])
+    charges = {"Logistics": round(trays * 0.85, 2)}
+    if spec["freight"]:
+        charges["Freight"] = spec["freight"]
+    cust_po = spec["cust_po"]
+    roll = rng.random()
+    if roll < 0.1:
+        cust_po = None
+    elif roll < 0.25:
+        trays += 1
+    return ParsedInvoice(spec["invoice_no"], cust_po, spec["invoice_date"], charges, float(trays))
+
+
+def main(argv=None):
+    from allocator import AccountMap
+    from excel_ops import ConsignmentIndex
+    from pipeline import process_invoice
+
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--invoices", type=int, default=5000)
+    ap.add_argument("--growers", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args(argv)
+
+    specs = [spec for _, spec in synth_batch(args.invoices, seed=args.seed)]
+    cons_index = ConsignmentIndex(consignment_frame(specs, 0, args.growers, args.seed))
+    account_map = AccountMap(maps_frame(args.growers))
+    rng = random.Random(args.seed)
+    inputs = [(spec["company"], parsed_from_spec(spec, rng)) for spec in specs]
+    del specs
+
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    kept = [process_invoice(company, parsed, cons_index, account_map, f"inv{i}.pdf")
+            for i, (company, parsed) in enumerate(inputs)]
+    gc.collect()
+    results = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+
+    lines = sum(len(k[0]) for k in kept)
+    failed = sum(1 for k in kept if not k[0])
+    n = len(inputs)
+    print(f"{n} invoices, {lines} lines, {failed} failed")
+    print(f"retained: {results / 1024:.0f} KiB total, {results / n:.0f} B/invoice, "
+          f"{results / max(lines, 1):.0f} B/line")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Serial vs process-pool PDF parsing throughput.
+
+    python -m benchmarks.bench_parse --invoices 200 --workers 8
+"""
+import argparse
+import os
+import time
+
+from benchmarks.synth import synth_batch
+from parsers import parse_pdf_bytes, parse_pdfs_parallel
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--invoices", type=int, default=200)
+    ap.add_argument("--pages", type=int, default=1)
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    args = ap.parse_args(argv)
+
+    pdfs = [data for data, _ in synth_batch(args.invoices, pages=args.pages)]
+
+    t0 = time.perf_counter()
+    serial = [parse_pdf_bytes(d, cache=False) for d in pdfs]
+    t_serial = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    parallel = parse_pdfs_parallel(pdfs, workers=args.workers, cache=False)
+    t_parallel = time.perf_counter() - t0
+
+    assert [(c, p) for c, p, _ in parallel] == serial, "parallel results differ from serial"
+    n = len(pdfs)
+    print(f"serial:   {n / t_serial:8.1f} invoices/s ({t_serial:.2f}s)")
+    print(f"parallel: {n / t_parallel:8.1f} invoices/s ({t_parallel:.2f}s, workers={args.workers})")
+    print(f"speedup:  {t_serial / t_parallel:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
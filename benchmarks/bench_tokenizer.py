@@ -0,0 +1,42 @@
+"""Per-invoice text parse time for each vendor parser (extraction excluded).
+
+    python -m benchmarks.bench_tokenizer --items 8 --filler 150 --repeat 500
+"""
+import argparse
+import random
+import timeit
+
+import vendors
+from benchmarks.synth import VENDORS
+
+
+def sample_text(company: str, items: int, filler: int = 15, seed: int = 0) -> str:
+    """Invoice text with `items` charge lines and `filler` non-charge lines
+       (delivery detail, remittance and terms pages of a freight statement)."""
+    rng = random.Random(seed)
+    trays = [rng.randint(20, 400) for _ in range(items)]
+    lines = VENDORS[company]("INV-000123" if company == "Bache Bros Pty Ltd" else "500123",
+                             "OZG100123", "12/03/2025", trays, 85.5)
+    lines += [f"Consignment {9000 + i} delivered to DC Somerton VIC on 12/03/2025, {rng.randint(1, 99)} pallets"
+              for i in range(filler)]
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--items", type=int, default=8, help="charge lines per invoice")
+    ap.add_argument("--filler", type=int, default=150, help="non-charge lines per invoice")
+    ap.add_argument("--repeat", type=int, default=500)
+    args = ap.parse_args(argv)
+
+    for company in VENDORS:
+        parse = vendors.get(company).parse
+        text = sample_text(company, args.items, args.filler)
+        best = min(timeit.repeat(lambda: parse(text), number=args.repeat, repeat=5))
+        ident = min(timeit.repeat(lambda: vendors.identify(text), number=args.repeat, repeat=5))
+        print(f"{company:28s} parse {best / args.repeat * 1e6:8.1f} us   "
+              f"identify {ident / args.repeat * 1e6:6.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Compare two benchmarks.run JSON results stage by stage.
+
+    python -m benchmarks.compare before.json after.json [--threshold 0.10]
+
+Exits 1 if any stage got slower by more than the threshold (relative).
+"""
+import argparse
+import json
+import sys
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("before")
+    ap.add_argument("after")
+    ap.add_argument("--threshold", type=float, default=0.10)
+    args = ap.parse_args(argv)
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before["params"] != after["params"]:
+        print("warning: runs used different parameters", file=sys.stderr)
+
+    regressed = False
+    print(f"{'stage':20s} {before['commit'] or 'before':>12s} {after['commit'] or 'after':>12s}   change")
+    for name, a in after["stages"].items():
+        b = before["stages"].get(name)
+        if not b:
+            continue
+        change = (a["seconds"] - b["seconds"]) / b["seconds"] if b["seconds"] else 0.0
+        flag = "  REGRESSION" if change > args.threshold else ""
+        regressed |= bool(flag)
+        print(f"{name:20s} {b['seconds']:11.3f}s {a['seconds']:11.3f}s {change:+8.1%}{flag}")
+    print(f"{'invoices/sec':20s} {before['invoices_per_sec']:12} {after['invoices_per_sec']:12}")
+    print(f"{'peak RSS MiB':20s} {before['peak_rss_mb']:12} {after['peak_rss_mb']:12}")
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
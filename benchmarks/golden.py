@@ -0,0 +1,213 @@
+"""Golden-corpus regression check and per-vendor parse latency.
+
+    python -m benchmarks.golden synth [CORPUS] --invoices 30 --pages 2
+    python -m benchmarks.golden record CORPUS [--update]
+    python -m benchmarks.golden check CORPUS [--repeat 5] [--out results.json]
+
+A corpus is a directory of invoice PDFs, each with two fixtures alongside:
+
+    NAME.pdf
+    NAME.txt            extracted text (full pdfplumber extraction, written by `record`)
+    NAME.golden.json    {"company": ..., "parsed": {invoice_no, cust_po, invoice_date,
+                         charges, total_trays}}
+
+`check` runs every PDF through each parse path and compares the output with its golden:
+
+    text        parse_text() on the stored text (vendor parsers and tokenizer only)
+    pdfplumber  full pdfplumber extraction, then parse_text()
+    fast        extract_and_parse(): pdfium text layer, page-targeted pdfplumber fallback
+    cached      parse_pdf_bytes() through a fresh PdfCache, timed on the cache hit
+
+Money compares to the half cent, everything else exactly. It prints p50/p90/p99 parse
+latency per vendor and path, and exits 1 on any mismatch. tests/test_golden.py runs it on
+a fresh synthetic corpus (single and multi-page) with the rest of the test suite, and on
+INVOICESPLIT_GOLDEN_CORPUS when that points at a recorded corpus, so parser changes (fast
+paths included) must pass it.
+
+`record` writes missing fixtures from the current parsers (review them before
+committing); --update rewrites every golden after an intended parsing change. `synth`
+builds a corpus of synthetic invoices whose goldens come from the invoice specs rather
+than from the parsers. Real anonymized invoices belong in a corpus outside the repo.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synth import synth_batch
+from parsers import extract_and_parse, extract_text, parse_pdf_bytes, parse_text
+from pdf_cache import PdfCache
+from records import ParsedInvoice
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), ".data", "golden")
+MONEY_TOLERANCE = 0.005
+
+
+def corpus_files(corpus: str) -> list:
+    return sorted(os.path.join(corpus, n) for n in os.listdir(corpus) if n.lower().endswith(".pdf"))
+
+
+def _fixture(pdf_path: str, suffix: str) -> str:
+    return os.path.splitext(pdf_path)[0] + suffix
+
+
+def golden_record(company, parsed) -> dict:
+    return {"company": company, "parsed": ParsedInvoice(*parsed)._asdict()}
+
+
+def spec_golden(spec) -> dict:
+    """What the parsers should read from a synthetic invoice, from its spec."""
+    charges = {"Logistics": round(sum(round(qty * 0.85, 2) for qty in spec["trays"]), 2)}
+    if spec["freight"]:
+        charges["Freight"] = spec["freight"]
+    return golden_record(spec["company"], (spec["invoice_no"], spec["cust_po"], spec["invoice_date"],
+                                           charges, sum(spec["trays"])))
+
+
+def differences(golden: dict, actual: dict) -> list:
+    """[(field, golden value, actual value)]; charges compare to MONEY_TOLERANCE."""
+    out = []
+    if golden["company"] != actual["company"]:
+        out.append(("company", golden["company"], actual["company"]))
+    for name, want in golden["parsed"].items():
+        got = actual["parsed"][name]
+        if name == "charges":
+            same = (set(want) == set(got or {})
+                    and all(abs(want[k] - got[k]) <= MONEY_TOLERANCE for k in want))
+        elif name == "total_trays":
+            same = want == got or (want is not None and got is not None and float(want) == float(got))
+        else:
+            same = want == got
+        if not same:
+            out.append((name, want, got))
+    return out
+
+
+def _write_json(path: str, obj) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(obj, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+
+def synth(args) -> int:
+    os.makedirs(args.corpus, exist_ok=True)
+    for i, (data, spec) in enumerate(synth_batch(args.invoices, seed=args.seed, pages=args.pages)):
+        path = os.path.join(args.corpus, f"synth{i:04d}.pdf")
+        with open(path, "wb") as f:
+            f.write(data)
+        with open(_fixture(path, ".txt"), "w", encoding="utf-8") as f:
+            f.write(extract_text(data))
+        _write_json(_fixture(path, ".golden.json"), spec_golden(spec))
+    print(f"{args.invoices} synthetic invoices -> {args.corpus}")
+    return 0
+
+
+def record(args) -> int:
+    written = 0
+    for path in corpus_files(args.corpus):
+        with open(path, "rb") as f:
+            data = f.read()
+        text_path, golden_path = _fixture(path, ".txt"), _fixture(path, ".golden.json")
+        if not os.path.exists(text_path):
+            with open(text_path, "w", encoding="utf-8") as f:
+                f.write(extract_text(data))
+        if args.update or not os.path.exists(golden_path):
+            with open(text_path, "r", encoding="utf-8") as f:
+                _write_json(golden_path, golden_record(*parse_text(f.read())))
+            written += 1
+    print(f"{written} golden file(s) written in {args.corpus}")
+    return 0
+
+
+def _run_paths(data: bytes, text: str, cache: PdfCache) -> dict:
+    """path name -> (company, parsed, seconds)."""
+    out = {}
+
+    def timed(name, fn):
+        t0 = time.perf_counter()
+        company, parsed = fn()
+        out[name] = (company, parsed, time.perf_counter() - t0)
+
+    timed("text", lambda: parse_text(text))
+    timed("pdfplumber", lambda: parse_text(extract_text(data)))
+    timed("fast", lambda: extract_and_parse(data)[1:])
+    miss = parse_pdf_bytes(data, cache=cache)
+    timed("cached", lambda: parse_pdf_bytes(data, cache=cache))
+    if miss != out["cached"][:2]:
+        out["cached (miss)"] = miss + (0.0,)
+    return out
+
+
+def check(args) -> int:
+    files = corpus_files(args.corpus)
+    if not files:
+        print(f"error: no PDFs in {args.corpus}", file=sys.stderr)
+        return 2
+    latencies = {}  # (vendor, path) -> [seconds]
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = PdfCache(tmp)
+        for path in files:
+            name = os.path.basename(path)
+            try:
+                with open(_fixture(path, ".golden.json"), "r", encoding="utf-8") as f:
+                    golden = json.load(f)
+                with open(_fixture(path, ".txt"), "r", encoding="utf-8") as f:
+                    text = f.read()
+            except FileNotFoundError as e:
+                print(f"{name}: missing fixture {os.path.basename(e.filename)} (run `record`)")
+                failures += 1
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            for rep in range(args.repeat):
+                results = _run_paths(data, text, cache)
+                for path_name, (company, parsed, seconds) in results.items():
+                    latencies.setdefault((golden["company"], path_name), []).append(seconds)
+                    if rep:
+                        continue
+                    for field, want, got in differences(golden, golden_record(company, parsed)):
+                        print(f"{name} [{path_name}] {field}: golden {want!r}, got {got!r}")
+                        failures += 1
+
+    report = []
+    print(f"\n{'vendor':28s} {'path':11s} {'n':>5s} {'p50 ms':>8s} {'p90 ms':>8s} {'p99 ms':>8s} {'inv/s':>8s}")
+    for (vendor, path_name), seconds in sorted(latencies.items()):
+        p50, p90, p99 = (np.percentile(seconds, q) * 1000 for q in (50, 90, 99))
+        rate = len(seconds) / sum(seconds) if sum(seconds) else float("inf")
+        report.append({"vendor": vendor, "path": path_name, "n": len(seconds),
+                       "p50_ms": round(p50, 3), "p90_ms": round(p90, 3), "p99_ms": round(p99, 3),
+                       "invoices_per_sec": round(rate, 1)})
+        print(f"{vendor:28s} {path_name:11s} {len(seconds):5d} {p50:8.2f} {p90:8.2f} {p99:8.2f} {rate:8.1f}")
+    print(f"\n{len(files)} invoices, {failures} mismatch(es)")
+    if args.out:
+        _write_json(args.out, {"corpus": os.path.abspath(args.corpus), "invoices": len(files),
+                               "mismatches": failures, "latency": report})
+    return 1 if failures else 0
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("synth", help="build a synthetic corpus with spec-derived goldens")
+    p.add_argument("corpus", nargs="?", default=DEFAULT_CORPUS)
+    p.add_argument("--invoices", type=int, default=30)
+    p.add_argument("--pages", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    p = sub.add_parser("record", help="write missing text fixtures and goldens from the current parsers")
+    p.add_argument("corpus", nargs="?", default=DEFAULT_CORPUS)
+    p.add_argument("--update", action="store_true", help="rewrite existing goldens too")
+    p = sub.add_parser("check", help="compare every parse path with the goldens and time them")
+    p.add_argument("corpus", nargs="?", default=DEFAULT_CORPUS)
+    p.add_argument("--repeat", type=int, default=1, help="timed runs per invoice (outputs checked on the first)")
+    p.add_argument("--out", help="write the latency report JSON here")
+    args = ap.parse_args(argv)
+    return {"synth": synth, "record": record, "check": check}[args.command](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
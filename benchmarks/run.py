@@ -0,0 +1,147 @@
+"""End-to-end stage benchmark on synthetic invoices and workbooks.
+
+    python -m benchmarks.run --invoices 500 --consignment-rows 50000 --out results.json
+    python -m benchmarks.compare before.json after.json
+
+Stages are timed separately (workbook load, PDF parse, matching, allocation, export)
+and reported with invoices/sec and peak RSS. Generated inputs are kept under
+--data-dir so repeated runs at the same scale skip generation.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+from benchmarks.synth import synth_batch
+from benchmarks.workbooks import consignment_frame, maps_frame
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(__file__), ".data")
+
+
+def peak_rss_mb() -> float:
+    """Peak RSS of this process plus its (pooled) children, in MiB (Linux reports KiB)."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+class StageTimer:
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        t0 = time.perf_counter()
+        yield
+        self.stages[name] = {"seconds": round(time.perf_counter() - t0, 4), "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def prepare_inputs(args):
+    """Writes (or reuses) the PDFs and workbooks for this scale; returns their paths."""
+    tag = f"n{args.invoices}-p{args.pages}-r{args.consignment_rows}-g{args.growers}-s{args.seed}"
+    root = os.path.join(args.data_dir, tag)
+    pdf_dir = os.path.join(root, "pdfs")
+    cons_path = os.path.join(root, "consignment.xlsx")
+    maps_path = os.path.join(root, "maps.xlsx")
+    if not os.path.exists(maps_path):
+        os.makedirs(pdf_dir, exist_ok=True)
+        batch = synth_batch(args.invoices, seed=args.seed, pages=args.pages)
+        for i, (data, _) in enumerate(batch):
+            with open(os.path.join(pdf_dir, f"inv{i:06d}.pdf"), "wb") as f:
+                f.write(data)
+        specs = [spec for _, spec in batch]
+        consignment_frame(specs, args.consignment_rows, args.growers, args.seed).to_excel(cons_path, index=False)
+        maps_frame(args.growers).to_excel(maps_path, index=False)
+    pdfs = sorted(os.path.join(pdf_dir, n) for n in os.listdir(pdf_dir))
+    return pdfs, cons_path, maps_path
+
+
+def run(args) -> dict:
+    from allocator import AccountMap, allocate_batch
+    from excel_ops import ConsignmentIndex
+    from exporter import iter_export_groups, numeric_columns, write_tab_delimited_with_header
+    from parsers import parse_pdfs_parallel
+    from utils import read_bytes
+    from pipeline import match_invoice
+
+    pdfs, cons_path, maps_path = prepare_inputs(args)
+    timer = StageTimer()
+    t_start = time.perf_counter()
+
+    with timer.stage("load_consignment"):
+        cons_index = ConsignmentIndex.from_excel(cons_path, snapshot=args.cache)
+    with timer.stage("load_maps"):
+        account_map = AccountMap.from_excel(maps_path)
+    with timer.stage("read_pdfs"):
+        blobs = [read_bytes(p) for p in pdfs]
+    with timer.stage("parse_pdfs"):
+        parsed = parse_pdfs_parallel(blobs, workers=args.workers, cache=args.cache)
+    with timer.stage("match"):
+        jobs, failed = [], 0
+        for company, inv, error in parsed:
+            job, _ = match_invoice(company, inv, cons_index, parse_error=error)
+            if job is None:
+                failed += 1
+            else:
+                jobs.append(job)
+    with timer.stage("allocate"):
+        export, alloc_failures = allocate_batch(jobs, account_map)
+    with timer.stage("export"):
+        with open(os.devnull, "w", newline="") as f:
+            write_tab_delimited_with_header(iter_export_groups(export), f, numeric=numeric_columns(export))
+
+    total = time.perf_counter() - t_start
+    n = len(pdfs)
+    return {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": {"invoices": n, "pages": args.pages, "consignment_rows": args.consignment_rows,
+                   "growers": args.growers, "workers": args.workers, "cache": args.cache, "seed": args.seed},
+        "stages": timer.stages,
+        "total_seconds": round(total, 4),
+        "invoices_per_sec": round(n / total, 2) if total else None,
+        "parse_invoices_per_sec": round(n / timer.stages["parse_pdfs"]["seconds"], 2),
+        "succeeded": len(jobs) - len(alloc_failures),
+        "failed": failed + len(alloc_failures),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--invoices", type=int, default=200, help="10 .. 10000")
+    ap.add_argument("--pages", type=int, default=1, help="pages per invoice")
+    ap.add_argument("--consignment-rows", type=int, default=10000, help="1000 .. 500000")
+    ap.add_argument("--growers", type=int, default=200)
+    ap.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    ap.add_argument("--cache", action="store_true", help="use the parsed-PDF cache and consignment snapshot (default: cold)")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    ap.add_argument("--out", help="write results JSON here (default: stdout only)")
+    args = ap.parse_args(argv)
+
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Synthetic vendor invoices for benchmarking (no third-party PDF writer needed)."""
+import random
+
+
+def make_pdf(pages) -> bytes:
+    """Minimal single-font PDF; `pages` is a list of pages, each a list of text lines."""
+    objs = []
+
+    def add(body: bytes) -> int:
+        objs.append(body)
+        return len(objs)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(b"")  # filled once the kids are known
+    kids = []
+    for lines in pages:
+        ops, y = [], 800
+        for line in lines:
+            esc = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+            ops.append(f"BT /F1 9 Tf 40 {y} Td ({esc}) Tj ET")
+            y -= 14
+        stream = "\n".join(ops).encode("latin-1")
+        content = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] /Contents %d 0 R "
+                        b"/Resources << /Font << /F1 %d 0 R >> >> >>" % (pages_id, content, font)))
+    objs[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % k for k in kids), len(kids))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % i + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, catalog, xref)
+    return bytes(out)
+
+
+def valleyfresh_lines(invoice_no, po, date, trays, freight):
+    lines = [f"TAX INVOICE {invoice_no}", f"Cust. Order No: {po}-1", f"Date: {date}",
+             "VENDOR", "FRESHMAX NATIONAL PTY LTD", "ABN 61 050 197 343"]
+    for qty in trays:
+        amt = round(qty * 0.85, 2)
+        lines += [f"Blueberry logistics {qty} 0.85 {amt * 0.1:.2f} {amt:.2f}", "BB125G"]
+    if freight:
+        lines.append(f"Freight charge 1 {freight:.2f} {freight * 0.1:.2f} {freight:.2f}")
+    lines.append("Please remit payment to the account below.")
+    return lines
+
+
+def deluca_lines(invoice_no, po, date, trays, freight):
+    lines = [f"Tax Invoice No: {invoice_no}", "De Luca Banana Marketing", "ABN 45 105 141 553",
+             f"Date {date}", "Customer Order No", po]
+    for qty in trays:
+        amt = round(qty * 0.85, 2)
+        lines.append(f"BLUEBERRIES 125G {qty} 0.85 {amt:.2f} {amt * 0.1:.2f} {amt * 1.1:.2f}")
+    if freight:
+        lines.append(f"TSPT FREIGHT 1 {freight:.2f} {freight:.2f} {freight * 0.1:.2f} {freight * 1.1:.2f}")
+    return lines
+
+
+def bache_lines(invoice_no, po, date, trays, freight):
+    lines = ["Bache Bros Pty Ltd", "ABN 29 612 732 064", "Invoice Number", invoice_no,
+             "Invoice Date", date, "Due Date", date, "Reference", po]
+    for qty in trays:
+        amt = round(qty * 0.85, 2)
+        lines.append(f"BLUE BERRY 12 1 {qty} 0.85 {amt * 0.1:.2f} {amt:.2f}")
+    if freight:
+        lines.append(f"FREIGHT {freight:.2f}")
+    return lines
+
+
+VENDORS = {
+    "FRESHMAX NATIONAL PTY LTD": valleyfresh_lines,
+    "De Luca Banana Marketing": deluca_lines,
+    "Bache Bros Pty Ltd": bache_lines,
+}
+
+
+def synth_invoice(rng: random.Random, company: str, seq: int, pages: int = 1):
+    """Returns (pdf bytes, spec dict) for one synthetic invoice of `company`."""
+    po = f"OZG{100000 + seq}"
+    if company == "Bache Bros Pty Ltd":
+        invoice_no = f"INV-{seq:06d}"
+        date = f"{rng.randint(1, 28)} Mar 2025"
+    else:
+        invoice_no = str(500000 + seq)
+        date = f"{rng.randint(1, 28)}/03/2025"
+    trays = [rng.randint(20, 400) for _ in range(rng.randint(1, 4))]
+    freight = round(rng.uniform(20, 200), 2) if rng.random() < 0.7 else 0.0
+
+    lines = VENDORS[company](invoice_no, po, date, trays, freight)
+    body = [lines] + [[f"Page {p + 1} of {pages}", "Terms and conditions apply."] for p in range(1, pages)]
+    spec = dict(company=company, invoice_no=invoice_no, cust_po=po, invoice_date=date,
+                trays=trays, freight=freight)
+    return make_pdf(body), spec
+
+
+def synth_batch(n: int, seed: int = 0, pages: int = 1):
+    rng = random.Random(seed)
+    companies = list(VENDORS)
+    return [synth_invoice(rng, companies[i % len(companies)], i, pages) for i in range(n)]
@@ -0,0 +1,38 @@
+"""Synthetic Consignment Summary and Account Maps workbooks matching a synth_batch()."""
+import random
+
+import pandas as pd
+from constants import (CONSIGNOR_COL, SUPPLIER_COL, PO_COL, TRAYS_COL, CROP_COL, COMPANY_CONSIGNORS)
+
+OTHER_CONSIGNORS = ["Costa Tasmania", "Mountain Blue Farms", "Driscoll's Australia"]
+OTHER_CROPS = ["Raspberry", "Strawberry", "Blackberry"]
+
+
+def grower_names(n: int):
+    return [f"Grower {i:04d} Pty Ltd" for i in range(n)]
+
+
+def consignment_frame(specs, rows: int, growers: int = 200, seed: int = 0) -> pd.DataFrame:
+    """One row per grower share of each invoice's PO (trays sum to the invoice), padded with
+       rows for other consignors, crops and POs up to `rows`."""
+    rng = random.Random(seed)
+    names = grower_names(growers)
+    data = []
+    for spec in specs:
+        total = sum(spec["trays"])
+        consignor = rng.choice(COMPANY_CONSIGNORS[spec["company"]])
+        n = min(rng.randint(1, 4), total)
+        cuts = sorted(rng.sample(range(1, total), n - 1)) if n > 1 else []
+        for grower, trays in zip(rng.sample(names, n), [b - a for a, b in zip([0] + cuts, cuts + [total])]):
+            data.append((consignor, grower, spec["cust_po"], trays, "Blueberry"))
+    all_consignors = [c for cs in COMPANY_CONSIGNORS.values() for c in cs] + OTHER_CONSIGNORS
+    while len(data) < rows:
+        data.append((rng.choice(all_consignors), rng.choice(names), f"OZG{rng.randint(900000, 999999)}",
+                     rng.randint(1, 400), rng.choice(OTHER_CROPS + ["Blueberry"])))
+    return pd.DataFrame(data, columns=[CONSIGNOR_COL, SUPPLIER_COL, PO_COL, TRAYS_COL, CROP_COL])
+
+
+def maps_frame(growers: int = 200) -> pd.DataFrame:
+    return pd.DataFrame([{"Supplier": name, "Logistics Account": f"6-{1000 + i}",
+                          "Freight Account": f"6-{5000 + i}", "Job Code": f"BB{i:04d}"}
+                         for i, name in enumerate(grower_names(growers))])
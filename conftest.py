@@ -0,0 +1 @@
+"""pytest: the modules live at the repo root, so this directory goes on sys.path."""
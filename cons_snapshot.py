@@ -0,0 +1,120 @@
+"""Columnar on-disk snapshot of the Consignment Summary.
+
+An uploaded workbook is read with openpyxl once, reduced to the five columns the
+matcher uses and written as one directory per workbook content hash:
+
+    meta.json                      format version, row count, category strings
+    consignor.npy supplier.npy     int32 category codes, one per workbook row
+    po.npy crop.npy
+    trays.npy                      float64 trays (non-numeric -> 0)
+
+Later loads of the same workbook skip Excel entirely. The .npy files are opened with
+mmap_mode="r", so every session on the machine shares the same page-cache pages.
+Every value is stored the way ConsignmentIndex reads it (str() of the cell), so an
+index built from a snapshot matches one built from the workbook.
+"""
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from constants import CONSIGNOR_COL, SUPPLIER_COL, PO_COL, TRAYS_COL, CROP_COL
+from utils import read_bytes
+
+SNAPSHOT_VERSION = 1
+DEFAULT_SNAPSHOT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "invoicesplit", "consignment")
+DEFAULT_KEEP = 8  # snapshots kept on disk, most recently used first
+
+# snapshot field -> workbook column
+CATEGORICAL = {"consignor": CONSIGNOR_COL, "supplier": SUPPLIER_COL, "po": PO_COL, "crop": CROP_COL}
+
+
+def encode_column(values):
+    """(int32 codes, categories) with every cell as str(), NaN included."""
+    codes, categories = pd.factorize(pd.Series([str(v) for v in values], dtype=object))
+    return codes.astype(np.int32), categories.tolist()
+
+
+class ConsignmentSnapshot:
+    """A snapshot directory opened read-only: `codes[field]` are memory-mapped arrays,
+       `categories[field]` the strings they index, `trays` the memory-mapped tray counts.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported consignment snapshot version: {meta.get('version')}")
+        self.path = path
+        self.rows = meta["rows"]
+        self.categories = meta["categories"]
+        self.codes = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r") for name in CATEGORICAL}
+        self.trays = np.load(os.path.join(path, "trays.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return self.rows
+
+    @staticmethod
+    def write(df: pd.DataFrame, path: str) -> None:
+        """Writes `df`'s consignment columns as a snapshot directory at `path`."""
+        os.makedirs(path, exist_ok=True)
+        categories = {}
+        for name, col in CATEGORICAL.items():
+            codes, categories[name] = encode_column(df[col])
+            np.save(os.path.join(path, name + ".npy"), codes)
+        trays = pd.to_numeric(df[TRAYS_COL], errors="coerce").fillna(0).astype(np.float64).to_numpy()
+        np.save(os.path.join(path, "trays.npy"), trays)
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": SNAPSHOT_VERSION, "rows": len(df), "categories": categories}, f)
+
+
+class SnapshotStore:
+    """Directory of consignment snapshots keyed by workbook SHA-256."""
+
+    def __init__(self, root: str = None, keep: int = DEFAULT_KEEP):
+        self.root = root or os.environ.get("INVOICESPLIT_SNAPSHOT_DIR") or DEFAULT_SNAPSHOT_DIR
+        self.keep = keep
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, f"{digest}-v{SNAPSHOT_VERSION}")
+
+    def load(self, excel_file, digest: str = None):
+        """(snapshot, hit): opens the workbook's snapshot, converting the workbook on a miss.
+           `digest`, the workbook's SHA-256 if the caller already has it, saves hashing it again.
+        """
+        data = read_bytes(excel_file)
+        path = self._path(digest or hashlib.sha256(data).hexdigest())
+        try:
+            snap = ConsignmentSnapshot(path)
+            os.utime(path)  # LRU touch
+            return snap, True
+        except (OSError, ValueError, KeyError):
+            pass
+
+        with metrics.timer("consignment_read"):
+            df = pd.read_excel(io.BytesIO(data), usecols=list(CATEGORICAL.values()) + [TRAYS_COL])
+        tmp = tempfile.mkdtemp(dir=self.root, suffix=".tmp")
+        try:
+            ConsignmentSnapshot.write(df, tmp)
+            shutil.rmtree(path, ignore_errors=True)  # stale/partial snapshot
+            os.replace(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+        self.prune()
+        return ConsignmentSnapshot(path), False
+
+    def prune(self) -> None:
+        """Removes all but the `keep` most recently used snapshots."""
+        with os.scandir(self.root) as it:
+            dirs = [(e.stat().st_mtime, e.path) for e in it if e.is_dir() and not e.name.endswith(".tmp")]
+        for _, path in sorted(dirs, reverse=True)[self.keep:]:
+            shutil.rmtree(path, ignore_errors=True)
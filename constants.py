@@ -1,14 +1,7 @@
-COMPANIES = {
-    "45105141553": "De Luca Banana Marketing",
-    "29612732064": "Bache Bros Pty Ltd",
-    "61050197343": "FRESHMAX NATIONAL PTY LTD",
-}
-
-CARD_NAMES = {
-    "De Luca Banana Marketing": "De Luca Banana Marketing Pty Ltd",
-    "Bache Bros Pty Ltd": "Bache Bros Pty Ltd",
-    "FRESHMAX NATIONAL PTY LTD": "FRESHMAX NATIONAL PTY LTD",
-}
+# Vendor tables (ABN -> company, MYOB card names, consignors, page markers) are built by
+# the vendors registry; add a carrier with vendors.register()
+from vendors import (ABNS as COMPANIES, CARD_NAMES, COMPANY_CONSIGNORS,
+                     PAGE_KEYWORDS as VENDOR_PAGE_KEYWORDS)
 
 # Excel column names (single source of truth)
 CONSIGNOR_COL = "Consignor"
@@ -17,9 +10,6 @@ PO_COL        = "TBC Ref. (Po No)"
 TRAYS_COL     = "Trays"
 CROP_COL      = "Crop"
 
-# Strict company→consignors
-COMPANY_CONSIGNORS = {
-    "FRESHMAX NATIONAL PTY LTD": ["Valley Fresh Sydney", "Valley Fresh Melbourne"],
-    "De Luca Banana Marketing": ["Valley Fresh Brisbane"],
-    "Bache Bros Pty Ltd": ["Bache Bros Warehouse"],
-}
\ No newline at end of file
+# MYOB import file columns, in output order
+EXPORT_COLUMNS = ["Co./Last Name", "Date", "Supplier Invoice No.", "Description", "Account No.",
+                  "Amount", "Job", "Tax Code", "Comment"]
@@ -1,45 +1,159 @@
+import re
+
+import numpy as np
 import pandas as pd
-from utils import norm, digits_only
-from constants import (CONSIGNOR_COL, SUPPLIER_COL, PO_COL, TRAYS_COL, CROP_COL, COMPANY_CONSIGNORS)
+
+import metrics
+from cons_snapshot import CATEGORICAL, ConsignmentSnapshot, SnapshotStore, encode_column
+from po_match import TrigramIndex
+from records import GrowerSplit
+from utils import norm, digits_only, resolve_default
+from constants import TRAYS_COL, COMPANY_CONSIGNORS
+
+BLUEBERRY = re.compile(r"Blueberry", re.IGNORECASE)
+
+
+class ConsignmentIndex:
+    """Consignment Summary parsed once and indexed by (company, PO).
+
+    Rows are pre-filtered to the consignors in COMPANY_CONSIGNORS and crop=Blueberry,
+    then keyed on both norm(PO) and digits_only(PO) so lookups are dict hits.
+    Built from a workbook DataFrame or from a memory-mapped ConsignmentSnapshot;
+    both are reduced to category codes first, so string work is per distinct value.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        columns = {name: encode_column(df[col]) for name, col in CATEGORICAL.items()}
+        trays = pd.to_numeric(df[TRAYS_COL], errors="coerce").fillna(0).astype(float).to_numpy()
+        with metrics.timer("consignment_index"):
+            self._build(columns, trays)
+
+    @classmethod
+    def from_snapshot(cls, snap: ConsignmentSnapshot) -> "ConsignmentIndex":
+        index = cls.__new__(cls)
+        columns = {name: (snap.codes[name], snap.categories[name]) for name in CATEGORICAL}
+        with metrics.timer("consignment_index"):
+            index._build(columns, snap.trays)
+        return index
+
+    def _build(self, columns: dict, trays):
+        """`columns`: field -> (codes, categories) for consignor/supplier/po/crop; `trays` per row.
+           Row positions are workbook rows, so sorting them keeps workbook order.
+        """
+        metrics.incr("consignment_rows_scanned", len(trays))
+        self._by_norm = {}    # (company, norm po)   -> [row positions]
+        self._by_digits = {}  # (company, digits po) -> [row positions]
+        self._po_text = {}    # (company, norm po)   -> PO as first written in the workbook
+        self._suggesters = {} # company -> TrigramIndex over its norm POs, built on first suggest()
+
+        crop_codes, crops = columns["crop"]
+        crop_ok = np.array([bool(BLUEBERRY.search(c)) for c in crops], dtype=bool)
+        rows_ok = crop_ok[crop_codes] if len(crops) else np.zeros(len(trays), dtype=bool)
+
+        po_codes, po_values = columns["po"]
+        po_norm = [norm(p) for p in po_values]
+        po_digits = [digits_only(p) for p in po_values]
+        consignor_codes, consignors = columns["consignor"]
+
+        for company, targets in COMPANY_CONSIGNORS.items():
+            target_codes = [i for i, c in enumerate(consignors) if c in targets]
+            mask = rows_ok & np.isin(consignor_codes, target_codes)
+            for pos in np.flatnonzero(mask).tolist():
+                code = po_codes[pos]
+                self._by_norm.setdefault((company, po_norm[code]), []).append(pos)
+                self._po_text.setdefault((company, po_norm[code]), po_values[code].strip())
+                if po_digits[code]:
+                    self._by_digits.setdefault((company, po_digits[code]), []).append(pos)
+
+        supplier_codes, suppliers = columns["supplier"]
+        self._supplier_codes = supplier_codes
+        self._growers = [s.strip() for s in suppliers]  # by supplier code
+        self._trays = trays
+
+    @classmethod
+    def from_excel(cls, excel_file, snapshot=True, digest: str = None) -> "ConsignmentIndex":
+        """Goes through the workbook's snapshot unless `snapshot` is False (see utils.resolve_default);
+           `digest` is the workbook's SHA-256 when already known.
+        """
+        store = resolve_default(snapshot, SnapshotStore)
+        if store is not None:
+            snap, hit = store.load(excel_file, digest)
+            metrics.incr("consignment_snapshot", result="hit" if hit else "miss")
+            return cls.from_snapshot(snap)
+        if hasattr(excel_file, "seek"):
+            excel_file.seek(0)
+        with metrics.timer("consignment_read"):
+            df = pd.read_excel(excel_file)
+        return cls(df)
+
+    def lookup(self, cust_po: str, company: str) -> GrowerSplit:
+        """Returns GrowerSplit(shares: dict[grower->pct], total_trays: float)"""
+        metrics.incr("consignment_lookups")
+        positions = self._rows(cust_po, company)
+        if not positions:
+            return GrowerSplit({}, 0)
+        metrics.incr("consignment_rows_matched", len(positions))
+
+        row_trays = [float(self._trays[p]) for p in positions]
+        total_trays = float(sum(row_trays))
+        if total_trays <= 0:
+            return GrowerSplit({}, 0)
+
+        splits = {}
+        for p, trays in zip(positions, row_trays):
+            grower = self._growers[self._supplier_codes[p]]
+            if grower and trays > 0:
+                splits[grower] = splits.get(grower, 0.0) + (trays / total_trays)
+        return GrowerSplit(splits, total_trays)
+
+    def _rows(self, cust_po: str, company: str) -> list:
+        """Workbook row positions matching the PO (exact or digits-only), in workbook order."""
+        hits = set(self._by_norm.get((company, norm(cust_po)), ()))
+        cust_po_digits = digits_only(cust_po)
+        if cust_po_digits:
+            hits.update(self._by_digits.get((company, cust_po_digits), ()))
+        return sorted(hits)
+
+    def po_lines(self, requests):
+        """Consignment lines of many (cust_po, company) requests at once, as parallel arrays
+           (owner, grower, trays) with one entry per matching workbook row: `owner` is the
+           request's position, rows are in workbook order within each request.
+        """
+        owner, positions = [], []
+        for i, (cust_po, company) in enumerate(requests):
+            rows = self._rows(cust_po, company) if cust_po else []
+            owner.extend([i] * len(rows))
+            positions.extend(rows)
+        positions = np.asarray(positions, dtype=np.int64)
+        growers = np.asarray(self._growers, dtype=object)
+        return (np.asarray(owner, dtype=np.int64), growers[np.asarray(self._supplier_codes)[positions]],
+                np.asarray(self._trays, dtype=float)[positions])
+
+    def suggest(self, cust_po: str, company: str, k: int = 5):
+        """Closest workbook POs for an unmatched PO, scoped to the company's consignors.
+           Returns [{"po", "score", "trays", "growers"}], best first; only POs with growers.
+        """
+        if not cust_po:
+            return []
+        suggester = self._suggesters.get(company)
+        if suggester is None:
+            keys = [po for (c, po) in self._by_norm if c == company]
+            suggester = self._suggesters[company] = TrigramIndex(keys)
+        metrics.incr("po_suggest_queries")
+        out = []
+        for key, score in suggester.search(norm(cust_po), k=k * 2):
+            po = self._po_text[(company, key)]
+            splits, trays = self.lookup(po, company)
+            if splits:
+                out.append({"po": po, "score": round(score, 3), "trays": trays, "growers": len(splits)})
+        return out[:k]
+
 
 def get_grower_split(excel_file, cust_po: str, company: str):
     """Strict: filter by consignor -> crop=Blueberry -> PO match (exact or digits-only).
-       Returns (splits: dict[grower->pct], total_trays: float)
+       Returns GrowerSplit(shares: dict[grower->pct], total_trays: float)
+
+       `excel_file` may be a prebuilt ConsignmentIndex; passing a workbook re-reads it on every call.
     """
-    df = pd.read_excel(excel_file)
-
-    target_consignors = COMPANY_CONSIGNORS.get(company, [])
-    df1 = df[df[CONSIGNOR_COL].astype(str).isin(target_consignors)]
-    if df1.empty:
-        return {}, 0
-
-    df1 = df1[df1[CROP_COL].astype(str).str.contains(r"Blueberry", case=False, na=False)]
-    if df1.empty:
-        return {}, 0
-
-    cust_po_norm   = norm(cust_po)
-    cust_po_digits = digits_only(cust_po)
-
-    po_norm_series   = df1[PO_COL].astype(str).map(norm)
-    po_digits_series = df1[PO_COL].astype(str).map(digits_only)
-
-    po_mask = (po_norm_series == cust_po_norm) | (
-        (cust_po_digits != "") & (po_digits_series == cust_po_digits)
-    )
-    df_po = df1[po_mask]
-    if df_po.empty:
-        return {}, 0
-
-    df_po = df_po.copy()
-    df_po[TRAYS_COL] = pd.to_numeric(df_po[TRAYS_COL], errors="coerce").fillna(0)
-    total_trays = float(df_po[TRAYS_COL].sum())
-    if total_trays <= 0:
-        return {}, 0
-
-    splits = {}
-    for _, row in df_po.iterrows():
-        grower = str(row[SUPPLIER_COL]).strip()
-        trays  = float(row[TRAYS_COL])
-        if grower and trays > 0:
-            splits[grower] = splits.get(grower, 0.0) + (trays / total_trays)
-    return splits, total_trays
+    index = excel_file if isinstance(excel_file, ConsignmentIndex) else ConsignmentIndex.from_excel(excel_file)
+    return index.lookup(cust_po, company)
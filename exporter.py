@@ -1,17 +1,152 @@
+import csv
 import io
+import numpy as np
 import pandas as pd
+from constants import EXPORT_COLUMNS
+
+import metrics
 
 def group_with_blank_lines(df: pd.DataFrame, group_col: str = "Supplier Invoice No.") -> pd.DataFrame:
-    out = df.copy()
-    out["_grp"] = out[group_col].astype(str)
-    lines = []
-    for _, g in out.groupby("_grp", sort=False):
-        lines.extend(g.drop(columns=["_grp"]).to_dict("records"))
-        lines.append({})  # blank
-    return pd.DataFrame(lines)
+    """Rows grouped by `group_col` (first-appearance order) with an all-blank row after each group."""
+    if df.empty:
+        return pd.DataFrame()
+    codes, _ = pd.factorize(df[group_col].map(str))
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    # each row shifts down by the number of blanks inserted before it (= its group number)
+    positions = np.arange(len(codes)) + codes
+    out = df.iloc[order].set_axis(positions)
+    return out.reindex(np.arange(len(codes) + codes[-1] + 1))
+
+def concat_exports(frames) -> pd.DataFrame:
+    """Joins export frames (blank separator rows included) as one.
+
+    Blank rows turn an integer column into float64. Where another frame has text in that
+    column, plain pd.concat would keep those floats in the joined object column, to be
+    written "61000.0" rather than "61000"; they are turned back into integers first.
+    """
+    frames = [f for f in frames if not f.empty]
+    if len(frames) < 2:
+        return frames[0] if frames else pd.DataFrame()
+    fixed = []
+    for f in frames:
+        mixed = [c for c in f.columns if pd.api.types.is_float_dtype(f[c].dtype)
+                 and any(c in g.columns and not pd.api.types.is_numeric_dtype(g[c].dtype) for g in frames)]
+        if mixed:
+            f = f.copy()
+            for c in mixed:
+                f[c] = pd.Series([int(v) if v == v and float(v).is_integer() else v for v in f[c].tolist()],
+                                 index=f.index, dtype=object)
+        fixed.append(f)
+    return pd.concat(fixed, ignore_index=True)
+
 
 def to_tab_delimited_with_header(df_export: pd.DataFrame) -> str:
     buf = io.StringIO()
     buf.write("{}\n")  # MYOB header row required
-    df_export.to_csv(buf, sep="\t", index=False, lineterminator="\r\n")
+    if metrics.is_enabled():
+        metrics.incr("export_lines", int(df_export.notna().any(axis=1).sum()))  # skip blank separators
+    with metrics.timer("export"):
+        df_export.to_csv(buf, sep="\t", index=False, lineterminator="\r\n")
     return buf.getvalue()
+
+
+_NUMBER = (int, float, np.integer, np.floating)
+
+
+def _is_number(v) -> bool:
+    return isinstance(v, _NUMBER) and not isinstance(v, (bool, np.bool_))
+
+
+def numeric_columns(export, columns=EXPORT_COLUMNS) -> frozenset:
+    """Columns of a whole export that DataFrame.to_csv writes as floats: those whose values
+       are all numbers, which the blank separator rows turn into float64. A column mixing
+       numbers and text stays object, and its integers are written as they are.
+
+    `export` is a frame with blank separator rows (typed by its inferred dtypes) or an
+    iterable of line groups (typed by their values).
+    """
+    if isinstance(export, pd.DataFrame):
+        dtypes = export.infer_objects().dtypes
+        return frozenset(c for c in columns if c in dtypes and pd.api.types.is_numeric_dtype(dtypes[c])
+                         and not pd.api.types.is_bool_dtype(dtypes[c]))
+    numeric = set(columns)
+    for group in export:
+        for line in group:
+            values = [line.get(c) for c in columns] if isinstance(line, dict) else line
+            for c, v in zip(columns, values):
+                if c in numeric and not (v is None or _is_number(v)):
+                    numeric.discard(c)
+    return frozenset(numeric)
+
+
+def _cell(v, numeric: bool):
+    """One value as DataFrame.to_csv writes it inside the blank-padded export frame:
+       numbers in an all-numeric (float64) column as floats, integers elsewhere as is.
+    """
+    if v is None or (isinstance(v, float) and v != v):
+        return ""
+    if isinstance(v, (bool, np.bool_)):
+        return str(bool(v))
+    if isinstance(v, (float, np.floating)) or (numeric and isinstance(v, _NUMBER)):
+        return repr(float(v))
+    if isinstance(v, _NUMBER):
+        return str(int(v))
+    return v
+
+
+def iter_tab_delimited_with_header(groups, columns=EXPORT_COLUMNS, header: bool = True, numeric=None):
+    """Streams the MYOB import file one invoice group at a time.
+
+    `groups` yields one invoice's lines at a time, each line a dict keyed by column
+    or a sequence in `columns` order. Output is the same as
+    to_tab_delimited_with_header(group_with_blank_lines(...)). `numeric` is the export's
+    numeric_columns(); pass it so only one group is ever held in memory, otherwise the
+    groups are read in full first to work it out. With header=False the "{}" line and
+    column names are left out, for appending to an existing file.
+    """
+    if numeric is None:
+        groups = list(groups)
+        numeric = numeric_columns(groups, columns)
+    is_numeric = [c in numeric for c in columns]
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter="\t", lineterminator="\r\n")
+    blank = [""] * len(columns)
+
+    if header:
+        buf.write("{}\n")  # MYOB header row required
+        writer.writerow(columns)
+    for group in groups:
+        metrics.incr("export_lines", len(group))
+        for line in group:
+            values = [line.get(c) for c in columns] if isinstance(line, dict) else line
+            writer.writerow([_cell(v, n) for v, n in zip(values, is_numeric)])
+        writer.writerow(blank)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def write_tab_delimited_with_header(groups, fh, columns=EXPORT_COLUMNS, numeric=None) -> None:
+    """Writes the streamed import file to a text file opened with newline=""."""
+    with metrics.timer("export"):
+        for chunk in iter_tab_delimited_with_header(groups, columns, numeric=numeric):
+            fh.write(chunk)
+
+
+def iter_export_groups(df_export: pd.DataFrame, columns=EXPORT_COLUMNS):
+    """Per-invoice line groups (tuples in `columns` order) from a frame with blank separator rows."""
+    if df_export.empty:
+        return
+    blank = df_export.isna().all(axis=1).to_numpy()
+    group = []
+    for is_blank, line in zip(blank, df_export[columns].itertuples(index=False, name=None)):
+        if is_blank:
+            yield group
+            group = []
+        else:
+            group.append(line)
+    if group:
+        yield group
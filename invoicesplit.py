@@ -0,0 +1,95 @@
+"""Headless batch runner.
+
+    python -m invoicesplit INVOICES... --consignment summary.xlsx --maps maps.xlsx \
+        [--out myob_import.txt] [--failures failures.csv] [--workers N] [--no-cache] \
+        [--metrics metrics.json] [--metrics-format json|prom] [--ledger PATH | --no-ledger]
+
+INVOICES may be PDF files or directories of PDFs. Invoices already in the export ledger
+are reported as failures rather than exported twice; each written import file is
+recorded there (see `python -m ledger`). Exits 1 if any invoice failed, 2 if the
+workbooks could not be used.
+"""
+import argparse
+import os
+import sys
+
+import pandas as pd
+import metrics
+from ledger import Ledger
+from exporter import iter_export_groups, numeric_columns, write_tab_delimited_with_header
+from pipeline import run_batch
+
+
+def collect_pdfs(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(os.path.join(item, n) for n in os.listdir(item) if n.lower().endswith(".pdf")))
+        else:
+            paths.append(item)
+    return paths
+
+
+def write_metrics(path, fmt):
+    text = metrics.to_prometheus() if fmt == "prom" else metrics.to_json() + "\n"
+    if path == "-":
+        sys.stdout.write(text)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="invoicesplit", description="Split invoices into a MYOB import file.")
+    ap.add_argument("invoices", nargs="+", help="PDF files or directories of PDFs")
+    ap.add_argument("--consignment", required=True, help="Consignment Summary workbook (.xlsx)")
+    ap.add_argument("--maps", required=True, help="Account Maps workbook (.xlsx)")
+    ap.add_argument("--out", default="myob_import.txt", help="MYOB import file to write")
+    ap.add_argument("--failures", default="failures.csv", help="CSV report of failed invoices")
+    ap.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    ap.add_argument("--no-cache", action="store_true", help="skip the parsed-PDF cache and consignment snapshot")
+    ap.add_argument("--metrics", help="write per-stage timings and counters here ('-' for stdout)")
+    ap.add_argument("--metrics-format", choices=("json", "prom"), default="json",
+                    help="metrics output: JSON or Prometheus text format")
+    ap.add_argument("--ledger", default=None, help="export ledger file (default: ~/.local/share/invoicesplit/ledger.sqlite3)")
+    ap.add_argument("--no-ledger", action="store_true", help="neither check nor record exported invoices")
+    args = ap.parse_args(argv)
+
+    pdfs = collect_pdfs(args.invoices)
+    if not pdfs:
+        ap.error("no PDF invoices found")
+
+    if args.metrics:
+        metrics.enable()
+        metrics.reset()
+
+    ledger = None if args.no_ledger else Ledger(args.ledger)
+    try:
+        result = run_batch(pdfs, args.consignment, args.maps, workers=args.workers, cache=not args.no_cache,
+                           ledger=ledger)
+    except ValueError as e:  # e.g. conflicting account mappings
+        print(f"error: {e}", file=sys.stderr)
+        return 2
+
+    # Always rewritten, header-only when nothing exported, so a previous run's file is never re-posted
+    export_id = None
+    with open(args.out, "w", encoding="utf-8", newline="") as f:
+        write_tab_delimited_with_header(iter_export_groups(result.export), f, numeric=numeric_columns(result.export))
+    if result.line_count and ledger is not None:
+        export_id = result.record(ledger, label=os.path.abspath(args.out))
+    cols = ["Source", "Company", "Invoice No.", "PO No.", "Reason"]
+    pd.DataFrame(result.failed_rows, columns=cols).to_csv(args.failures, index=False)
+
+    ok = len(pdfs) - len(result.failed_rows)
+    print(f"{ok}/{len(pdfs)} invoices processed, {result.line_count} MYOB lines -> {args.out}")
+    if result.failed_rows:
+        print(f"{len(result.failed_rows)} failed -> {args.failures}")
+    if export_id is not None:
+        print(f"recorded as export #{export_id} in {ledger.path}")
+    if args.metrics:
+        write_metrics(args.metrics, args.metrics_format)
+    return 1 if result.failed_rows else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+"""Persistent ledger of exported invoices (SQLite).
+
+Every MYOB export is recorded with the invoices it contained, their PDF content hash
+and their allocated lines. Lookups by (company, invoice_no, cust_po) or by content hash
+are index seeks, so re-uploaded invoices are caught before they are posted twice, and
+any recorded export can be written out again without the original PDFs.
+
+    python -m ledger list
+    python -m ledger export ID --out myob_import.txt
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+from constants import CARD_NAMES
+from exporter import iter_tab_delimited_with_header, write_tab_delimited_with_header
+
+DEFAULT_LEDGER_PATH = os.path.join(os.path.expanduser("~"), ".local", "share", "invoicesplit", "ledger.sqlite3")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS exports (
+    id          INTEGER PRIMARY KEY,
+    created_at  TEXT NOT NULL,
+    label       TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS invoices (
+    id            INTEGER PRIMARY KEY,
+    export_id     INTEGER NOT NULL REFERENCES exports(id),
+    company       TEXT NOT NULL,
+    invoice_no    TEXT NOT NULL,
+    cust_po       TEXT NOT NULL,
+    content_hash  TEXT,
+    source        TEXT NOT NULL DEFAULT '',
+    lines         TEXT NOT NULL,  -- JSON list of export lines (EXPORT_COLUMNS order)
+    group_start   INTEGER NOT NULL DEFAULT 1  -- 0: the lines continue the previous invoice's group
+);
+CREATE INDEX IF NOT EXISTS invoices_by_key ON invoices(company, invoice_no, cust_po);
+CREATE INDEX IF NOT EXISTS invoices_by_hash ON invoices(content_hash);
+CREATE INDEX IF NOT EXISTS invoices_by_export ON invoices(export_id);
+"""
+
+
+def _text(value) -> str:
+    return "" if value is None or value != value else str(value).strip()  # None / NaN -> ""
+
+
+def _line_key(line) -> tuple:
+    """(card name, invoice no, PO) of an export line, as _invoice_key gives it for its invoice."""
+    return _text(line[0]), _text(line[2]), _text(line[8])
+
+
+def _invoice_key(inv) -> tuple:
+    return _text(CARD_NAMES.get(inv["company"], inv["company"])), _text(inv["invoice_no"]), _text(inv["cust_po"])
+
+
+class Ledger:
+    """Exported invoices, one row per invoice per export. The same invoice exported twice
+       (e.g. deliberately re-posted) keeps both rows; find() reports the first. One Ledger
+       can be shared between threads (e.g. every session of the app).
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or os.environ.get("INVOICESPLIT_LEDGER") or DEFAULT_LEDGER_PATH
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.executescript(_SCHEMA)
+        if "group_start" not in {r["name"] for r in self._db.execute("PRAGMA table_info(invoices)")}:
+            self._db.execute("ALTER TABLE invoices ADD COLUMN group_start INTEGER NOT NULL DEFAULT 1")
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def find(self, company, invoice_no, cust_po, content_hash: str = None):
+        """Earliest export holding this invoice, matched on (company, invoice_no, cust_po) or on
+           the PDF content hash. Returns {"export_id", "created_at", "source", "matched_on"} or None.
+        """
+        query = """SELECT i.export_id, e.created_at, i.source FROM invoices i JOIN exports e ON e.id = i.export_id
+                   WHERE {} ORDER BY i.id LIMIT 1"""
+        row = None
+        with self._lock:
+            if _text(invoice_no):  # unreadable invoices are only matched by content
+                row = self._db.execute(query.format("i.company = ? AND i.invoice_no = ? AND i.cust_po = ?"),
+                                       (_text(company), _text(invoice_no), _text(cust_po))).fetchone()
+            matched_on = "invoice"
+            if row is None and content_hash:
+                row = self._db.execute(query.format("i.content_hash = ?"), (content_hash,)).fetchone()
+                matched_on = "content"
+        if row is None:
+            return None
+        return {"export_id": row["export_id"], "created_at": row["created_at"], "source": row["source"],
+                "matched_on": matched_on}
+
+    def record_export(self, invoices, groups, label: str = "", export_id: int = None) -> int:
+        """Records one export. `invoices` are dicts with company, invoice_no, cust_po,
+           content_hash and source; `groups` are the export's line groups
+           (exporter.iter_export_groups). Returns the new export id. With `export_id`, the
+           invoices are appended to that export instead (a rolling import file).
+
+           Lines go to the invoice with the same (card, invoice no, PO), so invoices sharing an
+           invoice number keep their own lines; rows are stored in file order with their group
+           breaks, so export_groups rebuilds the file as written.
+        """
+        invoices = list(invoices)
+        pending = {}  # (card name, invoice no, PO) -> invoices not yet given their lines, in order
+        for inv in invoices:
+            pending.setdefault(_invoice_key(inv), []).append(inv)
+        rows = []  # (invoice, lines, group_start), in file order
+        for group in groups:
+            key, group_start = None, 1
+            for line in group:
+                if _line_key(line) != key:
+                    key = _line_key(line)
+                    if pending.get(key):
+                        rows.append((pending[key].pop(0), [], group_start))
+                        group_start = 0
+                if rows:  # lines matching no invoice stay with the lines before them
+                    rows[-1][1].append(list(line))
+        unexported = {id(inv) for waiting in pending.values() for inv in waiting}
+        rows.extend((inv, [], 1) for inv in invoices if id(inv) in unexported)
+        with self._lock, self._db:
+            if export_id is None:
+                export_id = self._db.execute("INSERT INTO exports (created_at, label) VALUES (?, ?)",
+                                             (datetime.now().isoformat(timespec="seconds"), label)).lastrowid
+            self._db.executemany(
+                "INSERT INTO invoices (export_id, company, invoice_no, cust_po, content_hash, source, lines,"
+                " group_start) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(export_id, _text(inv["company"]), _text(inv["invoice_no"]), _text(inv["cust_po"]),
+                  inv.get("content_hash"), inv.get("source") or "", json.dumps(lines), group_start)
+                 for inv, lines, group_start in rows])
+        return export_id
+
+    def exports(self) -> list:
+        """[{"id", "created_at", "label", "invoices"}], newest first."""
+        with self._lock:
+            rows = self._db.execute("""SELECT e.id, e.created_at, e.label, COUNT(i.id) AS invoices
+                                       FROM exports e LEFT JOIN invoices i ON i.export_id = e.id
+                                       GROUP BY e.id ORDER BY e.id DESC""").fetchall()
+        return [dict(r) for r in rows]
+
+    def find_export(self, label: str):
+        """Id of the latest export recorded under `label`, or None."""
+        with self._lock:
+            row = self._db.execute("SELECT MAX(id) FROM exports WHERE label = ?", (label,)).fetchone()
+        return row[0]
+
+    def export_groups(self, export_id: int):
+        """The export's line groups in their original order, as recorded."""
+        with self._lock:
+            rows = self._db.execute("SELECT lines, group_start FROM invoices WHERE export_id = ? ORDER BY id",
+                                    (export_id,)).fetchall()
+        group = []
+        for lines, group_start in rows:
+            lines = json.loads(lines)
+            if not lines:
+                continue
+            if group_start and group:
+                yield group
+                group = []
+            group.extend(lines)
+        if group:
+            yield group
+
+    def export_text(self, export_id: int) -> str:
+        """The MYOB import file for a recorded export, regenerated without the PDFs."""
+        return "".join(iter_tab_delimited_with_header(self.export_groups(export_id)))
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="ledger", description="Inspect the exported-invoice ledger.")
+    ap.add_argument("--db", default=None, help=f"ledger file (default: {DEFAULT_LEDGER_PATH})")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="list recorded exports")
+    regen = sub.add_parser("export", help="rewrite a recorded export's MYOB import file")
+    regen.add_argument("export_id", type=int)
+    regen.add_argument("--out", default="myob_import.txt")
+    args = ap.parse_args(argv)
+
+    with Ledger(args.db) as ledger:
+        if args.command == "list":
+            for e in ledger.exports():
+                print(f"#{e['id']}\t{e['created_at']}\t{e['invoices']} invoices\t{e['label']}")
+            return 0
+        if not any(e["id"] == args.export_id for e in ledger.exports()):
+            print(f"error: no export #{args.export_id}", file=sys.stderr)
+            return 2
+        with open(args.out, "w", encoding="utf-8", newline="") as f:
+            write_tab_delimited_with_header(ledger.export_groups(args.export_id), f)
+    print(f"export #{args.export_id} -> {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
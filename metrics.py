@@ -0,0 +1,184 @@
+"""Per-stage timers and counters for the pipeline.
+
+Off by default; every call is then a flag check (timer() hands back a shared no-op
+context). Turn on process-wide with enable() or INVOICESPLIT_METRICS=1, or collect one
+run's numbers on their own with collect(): inside it, the current context (its thread, and
+the asyncio tasks and to_thread() calls started from it) records into a private Registry,
+so concurrent runs, such as two app sessions, neither mix nor reset each other's numbers.
+
+    with metrics.timer("extract"):
+        ...
+    metrics.incr("pages_extracted", len(pages))
+    metrics.incr("failures", reason="tray_mismatch")
+
+    with metrics.collect() as run:
+        ...
+    run.snapshot()
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+
+class Registry:
+    __slots__ = ("counters", "timers")
+
+    def __init__(self):
+        self.counters = {}  # key -> number
+        self.timers = {}    # name -> [calls, seconds]
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "timers": {name: {"calls": calls, "seconds": round(secs, 6)}
+                       for name, (calls, secs) in self.timers.items()},
+        }
+
+
+_enabled = os.environ.get("INVOICESPLIT_METRICS", "0") == "1"
+_global = Registry()
+_collecting = ContextVar("metrics_registry", default=None)
+
+
+def _current():
+    """The Registry to record into, or None when metrics are off here."""
+    reg = _collecting.get()
+    if reg is not None:
+        return reg
+    return _global if _enabled else None
+
+
+def enable(on: bool = True) -> None:
+    global _enabled
+    _enabled = on
+
+
+def is_enabled() -> bool:
+    return _current() is not None
+
+
+def reset() -> None:
+    reg = _collecting.get() or _global
+    reg.counters.clear()
+    reg.timers.clear()
+
+
+@contextmanager
+def collect():
+    """Records this context's metrics into a fresh Registry, which it yields."""
+    reg = Registry()
+    token = _collecting.set(reg)
+    try:
+        yield reg
+    finally:
+        _collecting.reset(token)
+
+
+def _key(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+def incr(name: str, value=1, **labels) -> None:
+    reg = _current()
+    if reg is None:
+        return
+    key = _key(name, labels)
+    reg.counters[key] = reg.counters.get(key, 0) + value
+
+
+class _Timer:
+    __slots__ = ("name", "reg", "t0")
+
+    def __init__(self, name, reg):
+        self.name = name
+        self.reg = reg
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stat = self.reg.timers.setdefault(self.name, [0, 0.0])
+        stat[0] += 1
+        stat[1] += time.perf_counter() - self.t0
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+def timer(name: str):
+    reg = _current()
+    return _NOOP if reg is None else _Timer(name, reg)
+
+
+def timed(name: str):
+    """Decorator form of timer()."""
+    def wrap(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            reg = _current()
+            if reg is None:
+                return fn(*args, **kwargs)
+            with _Timer(name, reg):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def snapshot() -> dict:
+    return (_collecting.get() or _global).snapshot()
+
+
+def merge(snap: dict) -> None:
+    reg = _current()
+    if reg is None or not snap:
+        return
+    for key, value in snap.get("counters", {}).items():
+        reg.counters[key] = reg.counters.get(key, 0) + value
+    for name, t in snap.get("timers", {}).items():
+        stat = reg.timers.setdefault(name, [0, 0.0])
+        stat[0] += t["calls"]
+        stat[1] += t["seconds"]
+
+
+def to_json() -> str:
+    return json.dumps(snapshot(), indent=2, sort_keys=True)
+
+
+def to_prometheus(prefix: str = "invoicesplit_") -> str:
+    """Prometheus text exposition format (counters and per-stage call/second totals)."""
+    reg = _collecting.get() or _global
+    counters, timers = reg.counters, reg.timers
+    lines = []
+    typed = set()
+    for key in sorted(counters):
+        name, _, labels = key.partition("{")
+        metric = f"{prefix}{name}_total"
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{'{' + labels if labels else ''} {counters[key]}")
+    if timers:
+        lines.append(f"# TYPE {prefix}stage_seconds_total counter")
+        lines.append(f"# TYPE {prefix}stage_calls_total counter")
+        for name in sorted(timers):
+            calls, secs = timers[name]
+            lines.append(f'{prefix}stage_seconds_total{{stage="{name}"}} {secs:.6f}')
+            lines.append(f'{prefix}stage_calls_total{{stage="{name}"}} {calls}')
+    return "\n".join(lines) + "\n"
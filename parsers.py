@@ -1,186 +1,305 @@
-import re
-import pdfplumber
-from constants import COMPANIES
-from utils import norm
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-def identify_company(text: str) -> str:
-    lines = [l.strip() for l in text.splitlines() if l.strip()]
-
-    for i, line in enumerate(lines):
-        if line.upper().startswith("VENDOR"):
-            # Look forward a few lines for ABN
-            for j in range(i, min(i + 10, len(lines))):
-                digits = re.sub(r"\D", "", lines[j])
-                if digits in COMPANIES:
-                    return COMPANIES[digits]
-
-    # Fallback: old method
-    clean = re.sub(r"\D", "", text)
-    for abn, company in COMPANIES.items():
-        if abn in clean:
-            return company
-
-    return "Unknown"
-
-
-def parse_valleyfresh(text: str):
-    inv = re.search(r"TAX INVOICE\s+(\d+)", text, re.IGNORECASE)
-    invoice_no = inv.group(1) if inv else None
-
-    po = re.search(r"Cust\.?\s*Ord(?:er)?\s*No\.?\s*:?[\s]*([A-Za-z0-9\-]+)", text, re.IGNORECASE)
-    cust_po = po.group(1).split("-")[0] if po else None
-
-    date_m = re.search(r"Date\s*[: ]\s*(\d{1,2}/\d{1,2}/\d{4})", text, re.IGNORECASE)
-    invoice_date = date_m.group(1) if date_m else None
-
-    lines = text.splitlines()
-
-    total_trays = 0
-    charges = {"Logistics": 0.0, "Freight": 0.0}
-
-    i = 0
-    while i < len(lines) - 1:
-        line = lines[i].strip()
-        next_line = lines[i + 1].strip()
-
-        parts = line.split()
-
-        # Check if numeric tail is present on line
-        if len(parts) >= 5:
-            try:
-                qty   = float(parts[-4])
-                price = float(parts[-3])
-                tax   = float(parts[-2])
-                amt   = float(parts[-1])
+import metrics
+import vendors
+from pdf_cache import PdfCache, content_hash
+from records import ParsedInvoice
+from tokenizer import NUM
+from utils import read_bytes, resolve_default
 
-                up = line.upper()
+# pdfplumber and pypdfium2 (which ships with it) are imported on first extraction:
+# together they are most of this module's import time.
+_pdfium = None  # the pypdfium2 module once loaded, False if it is not installed
 
-                # Freight
-                if "FREIGHT" in up:
-                    charges["Freight"] += amt
+# Bump whenever parsing output changes so cached results are not reused.
+PARSER_VERSION = 3
 
-                # Logistics (this line ALSO contains the product qty!)
-                elif "LOGISTIC" in up:
-                    charges["Logistics"] += amt
+# Set INVOICESPLIT_FAST_EXTRACT=0 to always use full pdfplumber extraction.
+FAST_EXTRACT = os.environ.get("INVOICESPLIT_FAST_EXTRACT", "1") != "0"
 
-                    # Product code is on NEXT line → treat as product
-                    total_trays += int(round(qty))
-
-                # Unexpected numeric-looking line → ignore
-
-            except:
-                pass
-
-        i += 1
-
-    # Clean empty charges
-    charges = {k: v for k, v in charges.items() if v}
-
-    return invoice_no, cust_po, invoice_date, charges, total_trays
-
-
-def parse_deluca(text: str):
-    inv = re.search(r"Tax Invoice No[: ]+(\d+)", text, re.IGNORECASE)
-    invoice_no = inv.group(1) if inv else None
-
-    po = re.search(r"Cust(?:omer)?\s*Order\s*No.*?\n([A-Za-z0-9\-]+)", text, re.IGNORECASE)
-    cust_po = po.group(1).split("-")[0] if po else None
+def identify_company(text: str) -> str:
+    """Registered vendor whose ABN appears in `text`, else "Unknown" (see vendors.identify)."""
+    return vendors.identify(text)
 
-    date_m = re.search(r"Date\s+(\d{1,2}/\d{1,2}/\d{4})", text, re.IGNORECASE)
-    invoice_date = date_m.group(1) if date_m else None
 
-    total_trays = 0
-    logistics_ex = 0
-    freight_ex = 0
+def extract_text(data: bytes, pages=None) -> str:
+    """Full layout-aware extraction with pdfplumber; `pages` optionally limits it to those page indexes."""
+    import pdfplumber
+    with metrics.timer("extract_pdfplumber"), pdfplumber.open(io.BytesIO(data)) as pdf:
+        selected = pdf.pages if pages is None else [pdf.pages[i] for i in pages]
+        metrics.incr("pages_extracted", len(selected), backend="pdfplumber")
+        return "\n".join([p.extract_text() or "" for p in selected])
 
-    for line in text.splitlines():
-        up = line.upper()
 
-        if "BLUEBERRIES" in up:
-            nums = re.findall(r"\d+(?:\.\d+)?", line)
-            if len(nums) >= 5:
-                qty = float(nums[-5])
-                amount_ex = float(nums[-3])
-                logistics_ex += amount_ex
-                total_trays += int(round(qty))
+def _fast_page_texts(data: bytes, first_only: bool = False):
+    """Per-page text via pdfium's text layer (no layout analysis), or None if unavailable."""
+    if not FAST_EXTRACT or not _load_pdfium():
+        return None
+    with metrics.timer("extract_pdfium"):
+        return _pdfium_page_texts(data, first_only)
 
-        elif "TSPT" in up or " DD " in f" {up} " or "FREIGHT" in up:
-            nums = re.findall(r"\d+(?:\.\d+)?", line)
-            if len(nums) >= 5:
-                amount_ex = float(nums[-3])
-                freight_ex += amount_ex
 
-    charges = {}
-    if logistics_ex:
-        charges["Logistics"] = round(logistics_ex, 2)
-    if freight_ex:
-        charges["Freight"] = round(freight_ex, 2)
+def _load_pdfium():
+    global _pdfium
+    if _pdfium is None:
+        try:
+            import pypdfium2
+            _pdfium = pypdfium2
+        except ImportError:
+            _pdfium = False
+    return _pdfium
 
-    return invoice_no, cust_po, invoice_date, charges, total_trays
 
-def extract_bache_invoice_date(text: str):
-    # Find "Invoice" followed by whitespace then "Date"
-    m = re.search(r"Invoice\s+Date", text, re.IGNORECASE)
-    if not m:
+def _pdfium_page_texts(data: bytes, first_only: bool):
+    try:
+        doc = _pdfium.PdfDocument(data)
+    except Exception:
         return None
-
-    # Look shortly after the label to avoid Due Date
-    tail = text[m.end(): m.end() + 150]
-
-    d = re.search(r"\d{1,2}\s+[A-Za-z]{3}\s+\d{4}", tail)
-    return d.group(0) if d else None
-
-
-def parse_bache(text: str):
-    # Normalise PDF whitespace FIRST
-    text = text.replace("\xa0", " ")
-
-    # ---------- Invoice number ----------
-    inv = re.search(
-        r"Invoice Number\s*(?:\n\s*)?([A-Z]{2,5}-\d+)",
-        text,
-        re.IGNORECASE
-    )
-    invoice_no = inv.group(1) if inv else None
-
-    # ---------- Invoice date (SAME STRUCTURE) ----------
-    invoice_date = extract_bache_invoice_date(text)
-
-    # ---------- Reference / PO ----------
-    po = re.search(
-        r"Reference\s*(?:\n\s*)?([A-Za-z0-9\-]+)",
-        text,
-        re.IGNORECASE
-    )
-    cust_po = po.group(1) if po else None
-
-    charges = {}
-    total_trays = 0
-
-    for line in text.splitlines():
-        up = line.upper()
-
-        if "BERRY" in up and "BLUE" in up:
-            nums = [float(n) for n in re.findall(r"\d+(?:\.\d+)?", line)]
-            if len(nums) >= 6:
-                total_trays += int(round(nums[2]))
-                charges["Logistics"] = charges.get("Logistics", 0) + nums[-1]
-
-        elif "FREIGHT" in up:
-            nums = [float(n) for n in re.findall(r"\d+(?:\.\d+)?", line)]
-            if nums:
-                charges["Freight"] = charges.get("Freight", 0) + nums[-1]
-
-    return invoice_no, cust_po, invoice_date, charges, total_trays
-
-def parse_pdf_filelike(file_like):
-    with pdfplumber.open(file_like) as pdf:
-        text = "\n".join([p.extract_text() or "" for p in pdf.pages])
-    company = identify_company(text)
-    if company == "FRESHMAX NATIONAL PTY LTD":
-        return company, parse_valleyfresh(text)
-    elif company == "De Luca Banana Marketing":
-        return company, parse_deluca(text)
-    elif company == "Bache Bros Pty Ltd":
-        return company, parse_bache(text)
-    return company, (None, None, None, {}, 0)
+    try:
+        count = 1 if first_only else len(doc)
+        texts = []
+        for i in range(min(count, len(doc))):
+            page = doc[i]
+            textpage = page.get_textpage()
+            texts.append(textpage.get_text_range().replace("\r\n", "\n").replace("\r", "\n"))
+            textpage.close()
+            page.close()
+        metrics.incr("pages_extracted", len(texts), backend="pdfium")
+        return texts
+    except Exception:
+        return None
+    finally:
+        doc.close()
+
+
+def _is_complete(parsed) -> bool:
+    invoice_no, cust_po, _, charges, total_trays = parsed
+    return bool(invoice_no and cust_po and charges and total_trays)
+
+
+def charges_parsed(company: str, text: str, charges) -> bool:
+    """False if a line carrying one of the vendor's charge markers is short of the numbers a
+       full charge line has, or its charge type did not parse: the text layer split or
+       reworded a row the parser then skipped.
+    """
+    markers = vendors.CHARGE_MARKERS.get(company)
+    if not markers:
+        return True
+    for ch_type, (marks, min_nums) in markers.items():
+        lines = [line for line in text.upper().split("\n") if any(m in f" {line} " for m in marks)]
+        if lines and (not charges.get(ch_type) or any(len(NUM.findall(line)) < min_nums for line in lines)):
+            return False
+    return True
+
+
+def _vendor_pages(company: str, page_texts) -> list:
+    """Page indexes a vendor's parser needs: the header page plus any page carrying its
+       charge lines (pages with no text layer are kept, in case layout extraction finds some).
+    """
+    keywords = vendors.PAGE_KEYWORDS.get(company, ())
+    return [i for i, t in enumerate(page_texts)
+            if i == 0 or not t.strip() or any(k in t.upper() for k in keywords)]
+
+
+def extract_and_parse(data: bytes):
+    """Returns (text, company, parsed).
+
+    Fast path: identify the vendor from page 1's ABN using pdfium's text layer, then parse
+    the known vendor from that backend's text. If the parse comes back incomplete, or any of
+    the vendor's charge lines in that text did not parse, re-extract with pdfplumber,
+    limited to the pages that vendor needs. Unknown documents get the
+    original full pdfplumber extraction.
+    """
+    first = _fast_page_texts(data, first_only=True)
+    if first:
+        company = identify_company(first[0])
+        page_texts = _fast_page_texts(data) if company != vendors.UNKNOWN else None
+        if page_texts:
+            text = "\n".join(page_texts)
+            parsed = parse_text(text, company)[1]
+            if _is_complete(parsed) and charges_parsed(company, text, parsed.charges):
+                return text, company, parsed
+            metrics.incr("fast_extract_fallbacks", company=company)
+            pages = _vendor_pages(company, page_texts)
+            text = extract_text(data, pages=pages)
+            parsed = parse_text(text, company)[1]
+            if _is_complete(parsed) or len(pages) == len(page_texts):
+                return text, company, parsed
+
+    text = extract_text(data)
+    company, parsed = parse_text(text)
+    return text, company, parsed
+
+
+def parse_text(text: str, company: str = None):
+    """(company, parsed) for extracted text; `company` skips identification when already known."""
+    with metrics.timer("parse_text"):
+        return _parse_known(text, company or identify_company(text))
+
+
+def _parse_known(text: str, company: str):
+    vendor = vendors.get(company)
+    return company, vendor.parse(text) if vendor else ParsedInvoice.empty()
+
+
+def parse_pdf_bytes(data: bytes, cache=True):
+    metrics.incr("pdf_bytes_read", len(data))
+    cache = resolve_default(cache, PdfCache)
+    key = cache.key(content_hash(data), PARSER_VERSION) if cache else None
+    if cache:
+        hit = cache.get(key)
+        if hit is not None:
+            metrics.incr("pdf_cache", result="hit")
+            _, company, parsed = hit
+            return company, parsed
+        metrics.incr("pdf_cache", result="miss")
+
+    text, company, parsed = extract_and_parse(data)
+    if cache:
+        cache.put(key, text, company, parsed)
+    return company, parsed
+
+
+def parse_pdf_filelike(file_like, cache=True):
+    return parse_pdf_bytes(read_bytes(file_like), cache=cache)
+
+
+def _parse_worker(data: bytes, collect_metrics: bool = False):
+    """Pool entry point. Returns (text, company, parsed, error, metrics snapshot or None).
+       Metrics go to a private registry, so neither a forked worker's copy of the parent's
+       numbers nor the executor thread's (context-less) state leaks in.
+    """
+    if not collect_metrics:
+        return _parse_one(data) + (None,)
+    with metrics.collect() as reg:
+        result = _parse_one(data)
+    return result + (reg.snapshot(),)
+
+
+def _parse_one(data: bytes):
+    try:
+        text, company, parsed = extract_and_parse(data)
+        return text, company, parsed, None
+    except Exception as e:
+        return None, vendors.UNKNOWN, ParsedInvoice.empty(), f"{type(e).__name__}: {e}"
+
+
+def _load(f, cache, want_hash: bool = False):
+    """Reads one input and checks the cache. Returns (data, digest, key, result): `digest` is
+       the content hash (when cached or `want_hash`), `result` the finished (company, parsed,
+       error) for cache hits and unreadable files, else None.
+    """
+    try:
+        data = read_bytes(f)
+    except Exception as e:
+        metrics.incr("read_errors")
+        return None, None, None, (vendors.UNKNOWN, ParsedInvoice.empty(), f"{type(e).__name__}: {e}")
+    metrics.incr("pdf_bytes_read", len(data))
+    digest = content_hash(data) if cache or want_hash else None
+    key = cache.key(digest, PARSER_VERSION) if cache else None
+    hit = cache.get(key) if cache else None
+    if cache:
+        metrics.incr("pdf_cache", result="hit" if hit is not None else "miss")
+    if hit is not None:
+        _, company, parsed = hit
+        return data, digest, key, (company, parsed, None)
+    return data, digest, key, None
+
+
+def _finish(cache, key, output):
+    """(company, parsed, error) from a _parse_worker output; stores successes in the cache."""
+    text, company, parsed, error, snap = output
+    metrics.merge(snap)
+    if error is not None:
+        metrics.incr("parse_errors")
+    elif cache:
+        cache.put(key, text, company, parsed)
+    return company, parsed, error
+
+
+def parse_pdfs_parallel(files, workers: int = None, cache=True, hashes: list = None):
+    """Parse a batch of PDFs (paths, bytes or file-likes) across a process pool.
+
+    Returns a list of (company, parsed, error) in input order; `error` is None on
+    success, otherwise the file's exception text and `parsed` is empty.
+    Cache hits are served in this process; only misses are sent to the pool.
+    `hashes`, if given, is filled with each file's content hash (None if unreadable), so
+    callers need not read and hash the files again.
+    """
+    cache = resolve_default(cache, PdfCache)
+    results = [None] * len(files)
+    pending = []  # (position, cache key, bytes)
+
+    for i, f in enumerate(files):
+        data, digest, key, results[i] = _load(f, cache, hashes is not None)
+        if hashes is not None:
+            hashes[i] = digest
+        if results[i] is None:
+            pending.append((i, key, data))
+
+    workers = min(workers or os.cpu_count() or 1, len(pending))
+    payloads = [data for _, _, data in pending]
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if pool:
+            # workers start with metrics off; each ships its numbers back with the result
+            flags = [metrics.is_enabled()] * len(payloads)
+            outputs = pool.map(_parse_worker, payloads, flags,
+                               chunksize=max(1, len(pending) // (workers * 4)))
+        else:
+            outputs = map(_parse_worker, payloads)
+        for (i, key, _), output in zip(pending, outputs):
+            results[i] = _finish(cache, key, output)
+    finally:
+        if pool:
+            pool.shutdown()
+    return results
+
+
+async def parse_pdfs_async(files, workers: int = None, cache=True, hashes: list = None):
+    """Async counterpart of parse_pdfs_parallel: yields (position, company, parsed, error) as
+       each file finishes rather than once the batch is done.
+
+    Each file is read, hashed and, on a cache miss, submitted to the pool before the next
+    one is read, so extraction starts with the first file. With one worker, extraction
+    runs on a single thread so the event loop stays free. `hashes` is filled as in
+    parse_pdfs_parallel, each entry before its file's result is yielded.
+    """
+    cache = resolve_default(cache, PdfCache)
+    loop = asyncio.get_running_loop()
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else ThreadPoolExecutor(max_workers=1)
+    collect = metrics.is_enabled()  # executor threads do not inherit the context, so ship numbers back too
+
+    async def run(i, key, data):
+        return i, key, await loop.run_in_executor(pool, _parse_worker, data, collect)
+
+    pending = set()
+    try:
+        for i, f in enumerate(files):
+            data, digest, key, result = _load(f, cache, hashes is not None)
+            if hashes is not None:
+                hashes[i] = digest
+            if result is not None:
+                yield (i,) + result
+            else:
+                pending.add(asyncio.ensure_future(run(i, key, data)))
+            await asyncio.sleep(0)  # let the loop hand work to the pool between reads
+            finished = {t for t in pending if t.done()}
+            pending -= finished
+            for t in finished:
+                i_done, key_done, output = t.result()
+                yield (i_done,) + _finish(cache, key_done, output)
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in finished:
+                i_done, key_done, output = t.result()
+                yield (i_done,) + _finish(cache, key_done, output)
+    finally:
+        for t in pending:
+            t.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        pool.shutdown(cancel_futures=True)
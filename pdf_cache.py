@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from records import ParsedInvoice
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "invoicesplit", "pdf")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+RESCAN_EVERY = 1000  # puts between directory scans, to see other processes' writes
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class PdfCache:
+    """On-disk cache of extracted PDF text + parsed invoice, keyed by content hash and parser version.
+
+    One JSON file per entry. A hit touches the file's mtime, and eviction removes the
+    least recently used files once the directory grows past `max_bytes`, down to 90% of it.
+    The directory is scanned only when the running total of bytes written goes over budget,
+    or every RESCAN_EVERY puts, not on every put.
+    """
+
+    def __init__(self, root: str = None, max_bytes: int = None):
+        self.root = root or os.environ.get("INVOICESPLIT_CACHE_DIR") or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            os.environ.get("INVOICESPLIT_CACHE_MAX_BYTES", DEFAULT_MAX_BYTES))
+        os.makedirs(self.root, exist_ok=True)
+        self._total = None  # estimated directory size; None until the first scan
+        self._puts = 0
+
+    def key(self, digest: str, version) -> str:
+        return f"{digest}-v{version}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key + ".json")
+
+    def get(self, key: str):
+        """Returns (text, company, parsed) or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # LRU touch
+        except (OSError, ValueError):
+            return None
+        return entry["text"], entry["company"], ParsedInvoice(*entry["parsed"])
+
+    def put(self, key: str, text: str, company: str, parsed) -> None:
+        entry = {"text": text, "company": company, "parsed": list(parsed)}
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+                size = f.tell()
+            os.replace(tmp, self._path(key))
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self._puts += 1
+        if self._total is not None:
+            self._total += size  # overestimates when an entry is replaced; the next scan corrects it
+        if self._total is None or self._total > self.max_bytes or self._puts % RESCAN_EVERY == 0:
+            self.evict()
+
+    def evict(self) -> None:
+        """Scans the directory and removes least recently used entries while over budget."""
+        entries = []
+        total = 0
+        with os.scandir(self.root) as it:
+            for e in it:
+                if not e.name.endswith(".json"):
+                    continue
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, e.path))
+                total += st.st_size
+        if total > self.max_bytes:
+            target = self.max_bytes * 0.9  # headroom, so a full cache is not rescanned on every put
+            for _, size, path in sorted(entries):
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                if total <= target:
+                    break
+        self._total = total
+
+    def clear(self) -> None:
+        with os.scandir(self.root) as it:
+            for e in it:
+                if e.name.endswith(".json"):
+                    os.remove(e.path)
+        self._total = 0
@@ -0,0 +1,308 @@
+import asyncio
+import os
+from dataclasses import dataclass, field
+
+import pandas as pd
+import metrics
+from parsers import parse_pdfs_async, parse_pdfs_parallel
+from excel_ops import ConsignmentIndex
+from allocator import AccountMap, allocate, allocate_batch
+from exporter import (concat_exports, group_with_blank_lines, iter_export_groups, iter_tab_delimited_with_header,
+                      numeric_columns)
+from constants import EXPORT_COLUMNS
+from records import FailedInvoice, FailReason
+from utils import make_payload_key
+
+
+@dataclass
+class BatchResult:
+    export: pd.DataFrame = field(default_factory=pd.DataFrame)  # MYOB lines, blank line after each invoice
+    failures: list = field(default_factory=list)         # FailedInvoice per failed invoice
+    parsed: list = field(default_factory=list)           # (source, company, parsed, parse_error) per PDF
+    fixed: list = field(default_factory=list)            # Keys resolved from the fix panel, in order
+    invoices: dict = field(default_factory=dict)         # Key -> identity (company, invoice_no, cust_po, source, content_hash)
+    exported: list = field(default_factory=list)         # Keys of the invoices in the export, in export order
+    _text: str = field(default=None, repr=False)         # export_text() cache, extended by resolve()
+    _text_numeric: frozenset = field(default=None, repr=False)  # numeric_columns() _text was written with
+
+    @property
+    def failed_rows(self) -> list:
+        """Failures as table rows (Company, Invoice No., PO No., Reason, Key, Source)."""
+        return [f.as_row() for f in self.failures]
+
+    def failure(self, key: str):
+        return next((f for f in self.failures if f.key == key), None)
+
+    @property
+    def line_count(self) -> int:
+        return int(self.export.notna().any(axis=1).sum())  # blank separator rows are all-NaN
+
+    def export_frame(self) -> pd.DataFrame:
+        return self.export
+
+    def export_text(self) -> str:
+        if self._text is None:
+            self._text_numeric = numeric_columns(self.export)
+            self._text = "".join(iter_tab_delimited_with_header(iter_export_groups(self.export),
+                                                                numeric=self._text_numeric))
+        return self._text
+
+    def resolve(self, key: str, lines: list) -> None:
+        """Moves a fixed invoice from failed to succeeded: drops its failure and appends its
+           AllocationLines to the end of the export. Nothing else in the batch is recomputed.
+        """
+        group = pd.DataFrame(lines, columns=EXPORT_COLUMNS) if lines else pd.DataFrame()
+        self.resolve_many([key], group_with_blank_lines(group, "Supplier Invoice No."))
+
+    def resolve_many(self, keys: list, export: pd.DataFrame) -> None:
+        """resolve() for several invoices at once; `export` holds their lines with a blank line
+           after each invoice (as allocate_batch returns them).
+        """
+        done = set(keys)
+        self.failures = [f for f in self.failures if f.key not in done]
+        self.fixed.extend(keys)
+        self.exported.extend(keys)
+        if export.empty:
+            return
+        self.export = concat_exports([self.export, export])
+        if self._text is not None:
+            if numeric_columns(self.export) != self._text_numeric:
+                self._text = None  # a column stopped being all-numeric: earlier lines are written differently
+            else:
+                added = self.export.iloc[len(self.export) - len(export):]  # as concat_exports typed it
+                self._text += "".join(iter_tab_delimited_with_header(iter_export_groups(added), header=False,
+                                                                    numeric=self._text_numeric))
+
+    def record(self, ledger, label: str = "") -> int:
+        """Records the export (every invoice in it, with its lines) in a Ledger; returns the export id."""
+        return ledger.record_export([self.invoices[k] for k in self.exported], iter_export_groups(self.export), label)
+
+    def _add_invoice(self, company, parsed, source, content_hash=None) -> str:
+        invoice_no, cust_po = parsed[0], parsed[1]
+        key = make_payload_key(company, invoice_no, cust_po or "")
+        self.invoices[key] = dict(company=company, invoice_no=invoice_no, cust_po=cust_po,
+                                  source=source, content_hash=content_hash)
+        return key
+
+
+def _failure(reason: FailReason, message, company, invoice_no, cust_po, invoice_date, charges, source="",
+             **extra) -> FailedInvoice:
+    metrics.incr("failures", reason=reason.value)
+    return FailedInvoice(reason, message, company, invoice_no, cust_po, invoice_date, charges, source, **extra)
+
+
+def check_ledger(ledger, company, parsed, source: str = "", content_hash: str = None):
+    """Fail 0: invoice already in a recorded export (same company/invoice/PO, or the same PDF).
+       Returns its FailedInvoice, or None when it is new or there is no ledger.
+    """
+    if ledger is None:
+        return None
+    invoice_no, cust_po, invoice_date, charges, invoice_trays = parsed
+    seen = ledger.find(company, invoice_no, cust_po, content_hash)
+    if seen is None:
+        return None
+    message = f"Already exported in export #{seen['export_id']} on {seen['created_at']}"
+    if seen["matched_on"] == "content":
+        message += f" (same PDF as {seen['source']})"
+    return _failure(FailReason.DUPLICATE, message, company, invoice_no, cust_po, invoice_date, charges, source,
+                    pdf_trays=invoice_trays, duplicate_of=seen["export_id"])
+
+
+def match_invoice(company, parsed, cons_index, source: str = "", parse_error: str = None):
+    """Consignment matching + tray checks for one parsed invoice.
+       Returns (job, failure): `job` holds allocate()'s arguments on success, otherwise it
+       is None and `failure` is the FailedInvoice.
+    """
+    invoice_no, cust_po, invoice_date, charges, invoice_trays = parsed
+
+    def fail(reason, message, **extra):
+        return None, _failure(reason, message, company, invoice_no, cust_po, invoice_date, charges, source, **extra)
+
+    # Unreadable PDF: nothing was parsed, so there is no PO to correct
+    if parse_error:
+        return fail(FailReason.ERROR, f"Could not read {source} ({parse_error})")
+
+    # Fail 1: missing PO
+    if not cust_po:
+        return fail(FailReason.MISSING_PO, f"Could not read PO from {source}", pdf_trays=invoice_trays)  # keep pdf_trays if we extracted a number
+
+    grower_split, excel_trays = cons_index.lookup(cust_po, company)
+
+    # Fail 2: no growers (often because consignment trays are zero/missing)
+    if not grower_split:
+        return fail(FailReason.NO_GROWERS, f"No growers found in Consignment Summary for PO {cust_po}",
+                    pdf_trays=invoice_trays, cons_trays=excel_trays)
+
+    inv_ok = isinstance(invoice_trays, (int, float)) and invoice_trays > 0
+    ex_ok  = isinstance(excel_trays, (int, float)) and excel_trays > 0
+
+    # Fail 3: invoice trays missing -> stash for manual tray fix
+    if not inv_ok:
+        return fail(FailReason.INVOICE_TRAYS_MISSING, "Could not determine tray count on the invoice",
+                    grower_split=grower_split, cons_trays=excel_trays)
+
+    # Fail 4: consignment trays missing
+    if not ex_ok:
+        return fail(FailReason.CONSIGNMENT_TRAYS_MISSING, "Consignment Summary tray total is missing/zero",
+                    pdf_trays=invoice_trays, cons_trays=excel_trays)
+
+    # Fail 5: tray mismatch
+    if int(round(invoice_trays)) != int(round(excel_trays)):
+        return fail(FailReason.TRAY_MISMATCH, f"Tray mismatch: Invoice has {int(round(invoice_trays))}, "
+                    f"Consignment has {int(round(excel_trays))}",
+                    pdf_trays=invoice_trays, cons_trays=excel_trays)
+
+    job = dict(invoice_no=invoice_no, cust_po=cust_po, charges=charges, grower_split=grower_split,
+               company=company, invoice_date=invoice_date)
+    return job, None
+
+
+def process_invoice(company, parsed, cons_index, account_map, source: str = "", parse_error: str = None):
+    """Runs one parsed invoice through consignment matching and allocation.
+       Returns (lines, failure): AllocationLines on success, else [] and the FailedInvoice.
+    """
+    job, failure = match_invoice(company, parsed, cons_index, source, parse_error)
+    if job is None:
+        return [], failure
+
+    # Allocation (may fail 6: missing mapping)
+    lines, fail_reason = allocate(**job, account_map=account_map)
+    if fail_reason:
+        return [], _failure(FailReason.ALLOCATION, fail_reason, company, job["invoice_no"], job["cust_po"],
+                            job["invoice_date"], job["charges"], source)
+    return lines, None
+
+
+def process_batch(parsed_pdfs, sources, cons_index, account_map, ledger=None, hashes=None) -> BatchResult:
+    """`parsed_pdfs` as returned by parse_pdfs_parallel; `sources` are the matching file names.
+       Matching runs per invoice; allocation runs once, vectorized, over every matched invoice.
+       With a `ledger`, invoices it already holds fail as duplicates (`hashes`: PDF content hashes).
+    """
+    result = BatchResult()
+    result.parsed = [(source,) + tuple(p) for source, p in zip(sources, parsed_pdfs)]
+
+    hashes = hashes or [None] * len(sources)
+    jobs, job_sources, job_keys = [], [], []
+    with metrics.timer("match"):
+        for source, digest, (company, parsed, parse_error) in zip(sources, hashes, parsed_pdfs):
+            key = result._add_invoice(company, parsed, source, digest)
+            failure = check_ledger(ledger, company, parsed, source, digest)
+            if failure is not None:
+                result.failures.append(failure)
+                continue
+            job, failure = match_invoice(company, parsed, cons_index, source, parse_error)
+            if job is None:
+                result.failures.append(failure)
+            else:
+                jobs.append(job)
+                job_sources.append(source)
+                job_keys.append(key)
+
+    # Allocation (may fail 6: missing mapping)
+    result.export, alloc_failures = allocate_batch(jobs, account_map)
+    result.exported = [k for i, k in enumerate(job_keys) if i not in alloc_failures]
+    for i, fail_reason in alloc_failures.items():
+        job = jobs[i]
+        result.failures.append(_failure(FailReason.ALLOCATION, fail_reason, job["company"], job["invoice_no"],
+                                        job["cust_po"], job["invoice_date"], job["charges"], job_sources[i]))
+    return result
+
+
+def run_batch(pdf_paths, consignment_path, maps_path, workers: int = None, cache=True, ledger=None) -> BatchResult:
+    """Headless end-to-end run: parse PDFs, match against the consignment summary, allocate.
+       `cache` covers both the parsed-PDF cache and the consignment snapshot; with a `ledger`,
+       already-exported invoices are reported as failures instead of exported again.
+    """
+    pdf_paths = list(pdf_paths)
+    account_map = AccountMap.from_excel(maps_path)
+    cons_index = ConsignmentIndex.from_excel(consignment_path, snapshot=cache)
+    hashes = [None] * len(pdf_paths) if ledger is not None else None  # filled while parsing
+    parsed_pdfs = parse_pdfs_parallel(pdf_paths, workers=workers, cache=cache, hashes=hashes)
+    sources = [os.path.basename(str(p)) for p in pdf_paths]
+    return process_batch(parsed_pdfs, sources, cons_index, account_map, ledger, hashes)
+
+
+async def _load_workbooks(consignment, maps, cache, shared, loaded):
+    """(cons_index, account_map), both workbooks loaded on threads. With a SharedCache they
+       come from it, and `loaded["leases"]` receives the leases that keep them referenced.
+    """
+    if shared is None:
+        cons_index, account_map = await asyncio.gather(
+            asyncio.to_thread(ConsignmentIndex.from_excel, consignment, cache),
+            asyncio.to_thread(AccountMap.from_excel, maps))
+    else:
+        leases = await asyncio.gather(asyncio.to_thread(shared.consignment_index, consignment, cache),
+                                      asyncio.to_thread(shared.account_map, maps))
+        if loaded is not None:
+            loaded["leases"] = leases
+        cons_index, account_map = (lease.value for lease in leases)
+    if loaded is not None:
+        loaded.update(cons_index=cons_index, account_map=account_map)
+    return cons_index, account_map
+
+
+async def process_batch_async(files, sources, consignment, maps, workers: int = None, cache=True,
+                              loaded: dict = None, ledger=None, hashes=None, shared=None):
+    """Pipelined ingestion for interactive use. Yields
+       (position, (company, parsed, parse_error), lines, failure) per invoice as
+       soon as it is parsed, matched and allocated, in completion order.
+
+    Both workbooks load on threads while the first PDFs are extracted; the first invoice
+    to finish waits only for them. A bad Account Maps workbook raises ValueError here.
+    `loaded`, if given, receives the "cons_index" and "account_map" built along the way.
+    `ledger` / `hashes` flag already-exported invoices as in process_batch; `hashes` is a
+    list of len(files) the content hashes are written into as files are read. `shared`, a
+    shared_cache.SharedCache, serves both workbooks' indexes across sessions.
+    """
+    workbooks = asyncio.ensure_future(_load_workbooks(consignment, maps, cache, shared, loaded))
+    parsed_pdfs = parse_pdfs_async(files, workers, cache, hashes)
+    try:
+        async for i, company, parsed, parse_error in parsed_pdfs:
+            cons_index, account_map = await workbooks
+            failure = check_ledger(ledger, company, parsed, sources[i], hashes[i] if hashes else None)
+            if failure is not None:
+                lines = []
+            else:
+                lines, failure = process_invoice(company, parsed, cons_index, account_map, sources[i], parse_error)
+            yield i, (company, parsed, parse_error), lines, failure
+    finally:
+        await parsed_pdfs.aclose()
+        workbooks.cancel()
+        await asyncio.gather(workbooks, return_exceptions=True)
+
+
+def iter_batch(files, sources, consignment, maps, workers: int = None, cache=True, loaded: dict = None,
+               ledger=None, hashes=None, shared=None):
+    """Runs process_batch_async on a private event loop and yields its results synchronously
+       (Streamlit scripts are not async).
+    """
+    loop = asyncio.new_event_loop()
+    results = process_batch_async(files, sources, consignment, maps, workers, cache, loaded, ledger, hashes,
+                                  shared)
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(results.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        loop.run_until_complete(results.aclose())
+        loop.close()
+
+
+def assemble_batch(results, sources, hashes=None) -> BatchResult:
+    """BatchResult from iter_batch() results, with the export and failures in input order."""
+    result = BatchResult()
+    ordered = sorted(results, key=lambda r: r[0])
+    result.parsed = [(sources[i],) + tuple(entry) for i, entry, _, _ in ordered]
+    all_lines = []
+    for i, (company, parsed, _), lines, failure in ordered:
+        key = result._add_invoice(company, parsed, sources[i], hashes[i] if hashes else None)
+        if lines:
+            result.exported.append(key)
+        if failure is not None:
+            result.failures.append(failure)
+        all_lines.extend(lines)
+    if all_lines:
+        result.export = group_with_blank_lines(pd.DataFrame(all_lines, columns=EXPORT_COLUMNS), "Supplier Invoice No.")
+    return result
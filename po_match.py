@@ -0,0 +1,87 @@
+"""Fuzzy PO candidates for invoices whose PO has no exact match.
+
+POs are compared after utils.norm(). Candidates come from a trigram index: the query's
+trigrams are looked up and their posting lists are counted with one np.bincount, so
+retrieval cost scales with the postings touched, not with the number of POs. Only the
+`shortlist` best-overlapping POs are then scored by edit distance, tuned for OCR: adjacent
+swaps count as one edit and look-alike characters (O/0, S/5, Z/2, ...) as half of one.
+"""
+import numpy as np
+
+from utils import digits_only
+
+
+def trigrams(s: str) -> set:
+    padded = f"^{s}$"  # boundary markers, so short POs and prefixes/suffixes still index
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+# Characters OCR commonly confuses in POs (after norm(), so upper case)
+_LOOKALIKES = {frozenset(p) for p in ("O0", "OD", "D0", "Q0", "I1", "L1", "S5", "Z2", "B8", "G6")}
+
+
+def _substitution(ca: str, cb: str) -> float:
+    if ca == cb:
+        return 0.0
+    return 0.5 if frozenset((ca, cb)) in _LOOKALIKES else 1.0
+
+
+def edit_distance(a: str, b: str) -> float:
+    """Optimal string alignment distance (Levenshtein plus adjacent transpositions), with
+       look-alike substitutions costing 0.5.
+    """
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    prev2, prev = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cost = _substitution(ca, cb)
+            cur[j] = min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + cost)
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                cur[j] = min(cur[j], prev2[j - 2] + 1)
+        prev2, prev = prev, cur
+    return prev[-1]
+
+
+def similarity(query: str, candidate: str) -> float:
+    """1.0 for identical normalized POs, falling with edit distance. A candidate whose digits
+       contain the query's (a missing "OZG" prefix, a cut "-2" suffix) scores at least as
+       high as the share of digits they have in common.
+    """
+    longest = max(len(query), len(candidate)) or 1
+    score = 1.0 - edit_distance(query, candidate) / longest
+    qd, cd = digits_only(query), digits_only(candidate)
+    if qd and cd and (qd in cd or cd in qd):
+        score = max(score, min(len(qd), len(cd)) / max(len(qd), len(cd)))
+    return score
+
+
+class TrigramIndex:
+    """Trigram postings over a fixed list of normalized PO strings."""
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        postings = {}
+        for i, key in enumerate(self.keys):
+            for gram in trigrams(key):
+                postings.setdefault(gram, []).append(i)
+        self._postings = {gram: np.asarray(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(self, query: str, k: int = 5, shortlist: int = 64, min_score: float = 0.5):
+        """Top-k (key, score) by similarity(), best first."""
+        lists = [self._postings[g] for g in trigrams(query) if g in self._postings]
+        if not lists:
+            return []
+        counts = np.bincount(np.concatenate(lists), minlength=len(self.keys))
+        n = min(shortlist, int(np.count_nonzero(counts)))
+        top = np.argpartition(counts, -n)[-n:]
+        scored = [(self.keys[i], similarity(query, self.keys[i])) for i in top.tolist() if counts[i]]
+        scored = [s for s in scored if s[1] >= min_score]
+        scored.sort(key=lambda s: (-s[1], s[0]))
+        return scored[:k]
@@ -0,0 +1,118 @@
+"""Bulk auto-resolve for tray mismatches (Fail 5).
+
+propose() reads the consignment lines of every mismatched invoice in one vectorized pass
+and proposes an adjusted grower split under the first rule that explains the difference:
+
+    drop_nonpositive  leaving out zero/negative tray lines (credits, placeholders) makes the
+                      consignment total equal the invoice's
+    drop_line         one consignment line holds exactly the surplus trays; it is dropped
+    proportional      the difference is within tolerance; the invoice's charges are split
+                      by the consignment's shares as they are
+
+approve() allocates every approved proposal with one allocate_batch() call and folds them
+into the batch together.
+"""
+from dataclasses import dataclass
+from typing import NamedTuple
+
+import numpy as np
+
+import metrics
+from allocator import allocate_batch
+from records import FailReason
+
+
+@dataclass(frozen=True)
+class Rules:
+    drop_nonpositive: bool = True
+    drop_line: bool = True
+    max_trays: float = 2     # proportional when |invoice - consignment| <= max_trays
+    max_pct: float = 0.01    # ... or <= max_pct of the consignment trays
+
+
+class Proposal(NamedTuple):
+    key: str
+    rule: str
+    detail: str
+    grower_split: dict       # grower -> share, as ConsignmentIndex.lookup returns it
+    pdf_trays: float
+    cons_trays: float
+
+
+def propose(failures, cons_index, rules: Rules = Rules()) -> list:
+    """Proposals for the TRAY_MISMATCH failures among `failures`, in their order. Invoices no
+       rule explains get none.
+    """
+    mismatched = [f for f in failures if f.reason is FailReason.TRAY_MISMATCH]
+    if not mismatched:
+        return []
+    with metrics.timer("reconcile"):
+        n = len(mismatched)
+        owner, growers, trays = cons_index.po_lines([(f.cust_po, f.company) for f in mismatched])
+        inv = np.array([f.pdf_trays for f in mismatched], dtype=float)
+        positive = trays > 0
+        cons = np.bincount(owner, weights=trays, minlength=n)  # the total the mismatch was reported on
+        pos_total = np.bincount(owner, weights=np.where(positive, trays, 0), minlength=n)
+        nonpositive = np.bincount(owner, weights=~positive, minlength=n).astype(int)
+        rule = np.full(n, "", dtype=object)
+        keep = positive.copy()       # lines that make up the proposed split
+        dropped = np.full(n, -1)     # drop_line: the dropped line
+
+        if rules.drop_nonpositive:
+            rule[(nonpositive > 0) & (np.round(pos_total) == np.round(inv))] = "drop_nonpositive"
+
+        if rules.drop_line:
+            cand = np.flatnonzero(positive & (rule[owner] == "")
+                                  & (np.round(pos_total[owner] - trays) == np.round(inv[owner])))
+            owners, first = np.unique(owner[cand], return_index=True)  # first such line per invoice
+            dropped[owners] = cand[first]
+            keep[cand[first]] = False
+            rule[owners] = "drop_line"
+
+        diff = inv - cons
+        tolerance = np.maximum(rules.max_trays, rules.max_pct * cons)
+        rule[(rule == "") & (np.abs(diff) <= tolerance) & (pos_total > 0)] = "proportional"
+
+        kept_total = np.bincount(owner, weights=np.where(keep, trays, 0), minlength=n).tolist()
+        splits = [{} for _ in range(n)]
+        for line in np.flatnonzero(keep & (rule[owner] != "")).tolist():
+            i, grower = int(owner[line]), growers[line]
+            if grower:
+                splits[i][grower] = splits[i].get(grower, 0.0) + float(trays[line]) / kept_total[i]
+
+        proposals = []
+        for i, f in enumerate(mismatched):
+            if not rule[i] or not splits[i]:
+                continue
+            c, v = int(round(cons[i])), int(round(inv[i]))
+            if rule[i] == "drop_nonpositive":
+                detail = f"Leave out {nonpositive[i]} zero/negative tray line(s): {c} → {v} trays"
+            elif rule[i] == "drop_line":
+                line = dropped[i]
+                detail = f"Drop {growers[line]}'s line of {int(round(trays[line]))} trays: {c} → {v} trays"
+            else:
+                detail = (f"Split {v} invoiced trays by the consignment's {c} "
+                          f"({v - c:+d} trays, {diff[i] / cons[i]:+.1%})")
+            metrics.incr("reconcile_proposals", rule=rule[i])
+            proposals.append(Proposal(f.key, rule[i], detail, splits[i], f.pdf_trays, f.cons_trays))
+    return proposals
+
+
+def approve(batch, proposals, account_map) -> dict:
+    """Allocates the proposals' invoices in one pass and moves them from the batch's failures
+       to its export. Returns {key: fail reason} for those allocation rejected (they stay failed).
+    """
+    failed = {f.key: f for f in batch.failures}
+    jobs, keys = [], []
+    for p in proposals:
+        f = failed.get(p.key)
+        if f is None:  # resolved meanwhile
+            continue
+        jobs.append(dict(invoice_no=f.invoice_no, cust_po=f.cust_po, charges=f.charges,
+                         grower_split=p.grower_split, company=f.company, invoice_date=f.invoice_date))
+        keys.append(p.key)
+    if not jobs:
+        return {}
+    export, alloc_failures = allocate_batch(jobs, account_map)
+    batch.resolve_many([k for i, k in enumerate(keys) if i not in alloc_failures], export)
+    return {keys[i]: reason for i, reason in alloc_failures.items()}
@@ -0,0 +1,80 @@
+"""Record types passed between the pipeline stages.
+
+ParsedInvoice, GrowerSplit and AllocationLine are NamedTuples: immutable, no per-instance
+dict, and still unpackable like the tuples they replace. AllocationLine's fields are in
+EXPORT_COLUMNS order, so lines go straight into a DataFrame or the export writer.
+"""
+from dataclasses import dataclass
+from enum import Enum
+from typing import NamedTuple, Optional
+
+from utils import make_payload_key
+
+
+class ParsedInvoice(NamedTuple):
+    invoice_no: Optional[str]
+    cust_po: Optional[str]
+    invoice_date: Optional[str]
+    charges: dict            # "Logistics" / "Freight" -> amount
+    total_trays: float
+
+    @classmethod
+    def empty(cls) -> "ParsedInvoice":
+        return cls(None, None, None, {}, 0)
+
+
+class GrowerSplit(NamedTuple):
+    shares: dict             # grower -> fraction of the PO's trays
+    total_trays: float
+
+
+class AllocationLine(NamedTuple):
+    card_name: str           # Co./Last Name
+    date: str
+    invoice_no: str          # Supplier Invoice No.
+    description: str
+    account_no: object
+    amount: float
+    job: object
+    tax_code: str
+    comment: str             # the PO
+
+
+class FailReason(Enum):
+    DUPLICATE = "duplicate"                                  # Fail 0
+    MISSING_PO = "missing_po"                                # Fail 1
+    NO_GROWERS = "no_growers"                                # Fail 2
+    INVOICE_TRAYS_MISSING = "invoice_trays_missing"          # Fail 3
+    CONSIGNMENT_TRAYS_MISSING = "consignment_trays_missing"  # Fail 4
+    TRAY_MISMATCH = "tray_mismatch"                          # Fail 5
+    ALLOCATION = "allocation"                                # Fail 6
+    ERROR = "error"                                          # unreadable PDF, or processing raised
+
+
+@dataclass(frozen=True, slots=True)
+class FailedInvoice:
+    """One failed invoice: why it failed, plus what the fix panel needs to reprocess it."""
+    reason: FailReason
+    message: str
+    company: str
+    invoice_no: Optional[str]
+    cust_po: Optional[str]
+    invoice_date: Optional[str]
+    charges: dict
+    source: str = ""
+    pdf_trays: Optional[float] = None     # trays read from the invoice
+    cons_trays: Optional[float] = None    # trays in the Consignment Summary for the PO
+    grower_split: Optional[dict] = None   # kept when only the invoice's tray count is missing
+    duplicate_of: Optional[int] = None    # ledger export id
+
+    @property
+    def key(self) -> str:
+        return make_payload_key(self.company, self.invoice_no, self.cust_po or "")
+
+    def parsed(self) -> ParsedInvoice:
+        return ParsedInvoice(self.invoice_no, self.cust_po, self.invoice_date, self.charges, self.pdf_trays)
+
+    def as_row(self) -> dict:
+        """Row for the failed-invoices table / CSV report."""
+        return {"Company": self.company, "Invoice No.": self.invoice_no, "PO No.": self.cust_po,
+                "Reason": self.message, "Key": self.key, "Source": self.source}
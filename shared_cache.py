@@ -0,0 +1,169 @@
+"""Process-wide cache of workbook-derived indexes, shared by every session of one app server.
+
+Entries are keyed by (kind, SHA-256 of the uploaded file). The first session to ask for a
+key builds it; sessions asking while it is being built wait for that build rather than
+starting their own, so N sessions uploading the same workbook cost one parse.
+
+Each acquire() returns a Lease that counts as a reference until it is released or garbage
+collected (a Streamlit session's leases go away with its session state). Whenever the
+entries' estimated size is over budget, the least recently used unreferenced entries are
+evicted. Referenced entries are never evicted, so the budget can be exceeded while they
+are in use.
+"""
+import io
+import os
+import sys
+import threading
+import weakref
+from concurrent.futures import Future
+from itertools import islice
+
+import numpy as np
+
+import metrics
+from allocator import AccountMap
+from excel_ops import ConsignmentIndex
+from pdf_cache import content_hash
+from utils import read_bytes
+
+DEFAULT_BUDGET_MB = 512
+
+_INT_SIZE = sys.getsizeof(10 ** 6)
+_SAMPLE = 256  # items of a large container that are walked; the rest are extrapolated
+
+
+def approx_size(obj) -> int:
+    """Rough deep size in bytes. Large containers are sized from a sample of their items.
+       Arrays count only if they own their data, so memory-mapped snapshot arrays (shared
+       through the page cache) are free.
+    """
+    seen, stack, total = set(), [(obj, 1.0)], 0.0
+    while stack:
+        o, weight = stack.pop()
+        if id(o) in seen:
+            continue
+        seen.add(id(o))
+        if isinstance(o, np.ndarray):
+            total += weight * (o.nbytes if o.flags.owndata else 0)
+            continue
+        total += weight * sys.getsizeof(o)
+        if isinstance(o, dict):
+            sample = list(islice(o.items(), _SAMPLE))
+            items = [x for kv in sample for x in kv]
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            sample = items = list(islice(o, _SAMPLE))
+        elif hasattr(o, "__dict__"):
+            o = sample = items = [vars(o)]
+        else:
+            continue
+        if not sample:
+            continue
+        share = weight * len(o) / len(sample)
+        if items is sample and type(items[0]) is int:  # row-position lists: count, don't walk
+            total += share * len(items) * _INT_SIZE
+        else:
+            stack.extend((x, share) for x in items)
+    return int(total)
+
+
+class Lease:
+    """A counted reference to a shared entry; `value` is the cached object."""
+
+    def __init__(self, cache, key, value):
+        self.key = key
+        self.value = value
+        self._finalizer = weakref.finalize(self, cache._release, key)
+
+    def release(self) -> None:
+        self._finalizer()  # runs at most once, here or when the lease is collected
+
+
+class _Entry:
+    __slots__ = ("future", "refs", "size")
+
+    def __init__(self):
+        self.future = Future()
+        self.refs = 0
+        self.size = 0
+
+
+class SharedCache:
+    """Thread-safe (kind, content hash) -> object cache with reference counts and a memory
+       budget (INVOICESPLIT_SHARED_CACHE_MB, default 512).
+    """
+
+    def __init__(self, budget_bytes: int = None):
+        self.budget = budget_bytes if budget_bytes is not None else int(
+            float(os.environ.get("INVOICESPLIT_SHARED_CACHE_MB", DEFAULT_BUDGET_MB)) * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> _Entry, least recently used first
+
+    def acquire(self, kind: str, data: bytes, build, digest: str = None) -> Lease:
+        """Lease on build(data), built at most once per (kind, content of `data`). `digest` is
+           the content hash of `data` when the caller already has it.
+        """
+        key = (kind, digest or content_hash(data))
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            owner = entry is None
+            if owner:
+                entry = _Entry()
+            self._entries[key] = entry  # (re)inserted last: most recently used
+            entry.refs += 1
+
+        if owner:
+            metrics.incr("shared_cache", kind=kind, result="miss")
+            try:
+                value = build(data)
+            except BaseException as e:
+                with self._lock:
+                    self._entries.pop(key, None)
+                entry.future.set_exception(e)  # waiting sessions get the same error
+                raise
+            entry.size = approx_size(value)
+            entry.future.set_result(value)
+            with self._lock:
+                self._evict()
+        else:
+            metrics.incr("shared_cache", kind=kind, result="hit" if entry.future.done() else "wait")
+            try:
+                value = entry.future.result()
+            except BaseException:
+                with self._lock:
+                    entry.refs -= 1
+                raise
+        return Lease(self, key, value)
+
+    def consignment_index(self, excel_file, snapshot=True) -> Lease:
+        data = read_bytes(excel_file)
+        digest = content_hash(data)  # keys both this cache and the on-disk snapshot
+        return self.acquire("consignment", data,
+                            lambda data: ConsignmentIndex.from_excel(io.BytesIO(data), snapshot, digest), digest)
+
+    def account_map(self, excel_file) -> Lease:
+        return self.acquire("account_map", read_bytes(excel_file),
+                            lambda data: AccountMap.from_excel(io.BytesIO(data)))
+
+    def _release(self, key) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.refs -= 1
+                self._evict()
+
+    def _evict(self) -> None:
+        """Drops unreferenced entries, least recently used first, until within budget. Lock held."""
+        total = sum(e.size for e in self._entries.values())
+        for key, entry in list(self._entries.items()):
+            if total <= self.budget:
+                break
+            if entry.refs <= 0 and entry.future.done():
+                del self._entries[key]
+                total -= entry.size
+                metrics.incr("shared_cache_evictions", kind=key[0])
+
+    def stats(self) -> list:
+        """[{"kind", "hash", "refs", "bytes"}] for the built entries, least recently used first."""
+        with self._lock:
+            return [{"kind": kind, "hash": digest[:12], "refs": e.refs, "bytes": e.size}
+                    for (kind, digest), e in self._entries.items() if e.future.done()]
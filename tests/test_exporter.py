@@ -0,0 +1,65 @@
+"""The streamed export writer against DataFrame.to_csv, the way the import file was written."""
+import random
+
+import pandas as pd
+
+from allocator import AccountMap, allocate, allocate_batch
+from constants import EXPORT_COLUMNS
+from exporter import (group_with_blank_lines, iter_export_groups, iter_tab_delimited_with_header, numeric_columns,
+                      to_tab_delimited_with_header)
+from pipeline import BatchResult
+
+
+def _reference(invoices, account_map) -> str:
+    rows = [line for inv in invoices for line in allocate(**inv, account_map=account_map)[0]]
+    return to_tab_delimited_with_header(group_with_blank_lines(pd.DataFrame(rows, columns=EXPORT_COLUMNS)))
+
+
+def _invoices(rng, growers):
+    out = []
+    for k in range(rng.randint(1, 4)):
+        picked = rng.sample(growers, rng.randint(1, 3))
+        charges = {"Logistics": round(rng.uniform(10, 500), 2)}
+        if rng.random() < 0.6:
+            charges["Freight"] = round(rng.uniform(5, 100), 2)
+        out.append(dict(invoice_no=str(100 + k), cust_po=f"P{k}", charges=charges,
+                        grower_split={g: 1 / len(picked) for g in picked}, company="X", invoice_date="1/1/2026"))
+    return out
+
+
+def test_mixed_account_map_matches_to_csv():
+    # numeric logistics accounts, text freight accounts, jobs mixing both
+    account_map = AccountMap(pd.DataFrame({"Supplier": ["A", "B"], "Logistics Account": [61000, 61010],
+                                           "Freight Account": ["6-1100", "6-1110"], "Job Code": [100, "J2"]}))
+    invoices = [dict(invoice_no="1", cust_po="P1", charges={"Logistics": 85.0, "Freight": 20.0},
+                     grower_split={"A": 0.5, "B": 0.5}, company="X", invoice_date="1/1/2026")]
+    export, _ = allocate_batch(invoices, account_map)
+    text = "".join(iter_tab_delimited_with_header(iter_export_groups(export), numeric=numeric_columns(export)))
+    assert text == _reference(invoices, account_map)
+    assert "\t61000\t" in text and "\t100\t" in text
+
+
+def test_random_account_maps_match_to_csv():
+    for seed in range(100):
+        rng = random.Random(seed)
+        value = lambda: rng.randint(1000, 99999) if rng.random() < 0.7 else f"6-{rng.randint(1000, 9999)}"
+        growers = [f"G{i}" for i in range(6)]
+        account_map = AccountMap(pd.DataFrame({"Supplier": growers,
+                                               "Logistics Account": [value() for _ in growers],
+                                               "Freight Account": [value() for _ in growers],
+                                               "Job Code": [value() for _ in growers]}))
+        invoices = _invoices(rng, growers)
+        expected = _reference(invoices, account_map)
+
+        export, _ = allocate_batch(invoices, account_map)
+        streamed = "".join(iter_tab_delimited_with_header(iter_export_groups(export), numeric=numeric_columns(export)))
+        assert streamed == expected, seed
+        assert "".join(iter_tab_delimited_with_header(iter_export_groups(export))) == expected, seed
+
+        # the first invoice exported, the rest folded in by the fix panel one at a time
+        batch = BatchResult()
+        batch.export, _ = allocate_batch(invoices[:1], account_map)
+        batch.export_text()
+        for inv in invoices[1:]:
+            batch.resolve_many([inv["invoice_no"]], allocate_batch([inv], account_map)[0])
+        assert batch.export_text() == expected, seed
@@ -0,0 +1,22 @@
+"""Every parse path against golden outputs (benchmarks/golden.py).
+
+A synthetic corpus is built and checked on each run. Set INVOICESPLIT_GOLDEN_CORPUS to a
+recorded corpus of real (anonymized) invoices to check those as well.
+"""
+import os
+
+import pytest
+
+from benchmarks import golden
+
+
+def test_synthetic_corpus(tmp_path):
+    for pages in (1, 3):
+        corpus = str(tmp_path / f"pages{pages}")
+        assert golden.main(["synth", corpus, "--invoices", "6", "--pages", str(pages), "--seed", str(pages)]) == 0
+        assert golden.main(["check", corpus]) == 0
+
+
+@pytest.mark.skipif(not os.environ.get("INVOICESPLIT_GOLDEN_CORPUS"), reason="INVOICESPLIT_GOLDEN_CORPUS not set")
+def test_recorded_corpus():
+    assert golden.main(["check", os.environ["INVOICESPLIT_GOLDEN_CORPUS"]]) == 0
@@ -0,0 +1,51 @@
+"""Recorded exports are rebuilt as they were written, invoice by invoice."""
+import pandas as pd
+
+from allocator import AccountMap, allocate_batch
+from exporter import concat_exports, iter_export_groups, iter_tab_delimited_with_header
+from ledger import Ledger, main
+
+ACCOUNT_MAP = AccountMap(pd.DataFrame({"Supplier": ["A", "B"], "Logistics Account": [61000, 61010],
+                                       "Freight Account": [61100, 61110], "Job Code": ["J1", "J2"]}))
+
+
+def _invoice(invoice_no, cust_po, growers, company="X"):
+    return dict(invoice_no=invoice_no, cust_po=cust_po, charges={"Logistics": 85.0, "Freight": 20.0},
+                grower_split={g: 1 / len(growers) for g in growers}, company=company, invoice_date="1/1/2026")
+
+
+def _record(ledger, invoices, export, **kw):
+    ids = [dict(company=inv["company"], invoice_no=inv["invoice_no"], cust_po=inv["cust_po"],
+                content_hash=f"h{i}", source=f"{i}.pdf") for i, inv in enumerate(invoices)]
+    return ledger.record_export(ids, iter_export_groups(export), **kw)
+
+
+def test_shared_invoice_number_keeps_each_invoices_lines(tmp_path):
+    # same vendor and invoice number, different POs: one group in the file, two ledger rows
+    invoices = [_invoice("7", "P1", ["A"]), _invoice("8", "P2", ["A", "B"]), _invoice("7", "P3", ["B"])]
+    export, _ = allocate_batch(invoices, ACCOUNT_MAP)
+    expected = "".join(iter_tab_delimited_with_header(iter_export_groups(export)))
+    with Ledger(str(tmp_path / "ledger.sqlite3")) as ledger:
+        export_id = _record(ledger, invoices, export)
+        assert ledger.export_text(export_id) == expected
+        rows = ledger._db.execute("SELECT cust_po, lines FROM invoices ORDER BY id").fetchall()
+        assert [(r["cust_po"], r["lines"].count("P1"), r["lines"].count("P3")) for r in rows] == \
+               [("P1", 2, 0), ("P3", 0, 2), ("P2", 0, 0)]
+    out = tmp_path / "regen.txt"
+    assert main(["--db", str(tmp_path / "ledger.sqlite3"), "export", str(export_id), "--out", str(out)]) == 0
+    assert out.read_bytes().decode("utf-8") == expected
+
+
+def test_rolling_export_keeps_its_groups(tmp_path):
+    # appended one invoice at a time: the same invoice number twice is two groups, not one
+    invoices = [_invoice("7", "P1", ["A"]), _invoice("7", "P2", ["B"]), _invoice("9", "", ["A"])]
+    with Ledger(str(tmp_path / "ledger.sqlite3")) as ledger:
+        export_id = None
+        frames = []
+        for inv in invoices:
+            export, _ = allocate_batch([inv], ACCOUNT_MAP)
+            frames.append(export)
+            export_id = _record(ledger, [inv], export, label="rolling", export_id=export_id)
+        expected = "".join(iter_tab_delimited_with_header(iter_export_groups(concat_exports(frames))))
+        assert ledger.export_text(export_id) == expected
+        assert ledger.exports()[0]["invoices"] == 3
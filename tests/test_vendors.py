@@ -0,0 +1,19 @@
+"""Vendor identification by ABN."""
+import vendors
+
+
+def test_vendor_block_beats_an_earlier_labelled_abn():
+    # the buyer's registered ABN comes first; the VENDOR block names the biller
+    text = "FRESHMAX NATIONAL PTY LTD ABN 61 050 197 343\nVENDOR\nDe Luca Banana Marketing\nABN 45 105 141 553"
+    assert vendors.identify(text) == "De Luca Banana Marketing"
+
+
+def test_vendor_block_abn_without_label():
+    text = "ABN 61 050 197 343\n\nVendor:\nBache Bros Pty Ltd\n29 612 732 064\n"
+    assert vendors.identify(text) == "Bache Bros Pty Ltd"
+
+
+def test_labelled_abn_then_digit_scan():
+    assert vendors.identify("Tax invoice\nABN: 45105141553\n") == "De Luca Banana Marketing"
+    assert vendors.identify("Reg 29-612-732-064") == "Bache Bros Pty Ltd"
+    assert vendors.identify("no ABN here 123") == vendors.UNKNOWN
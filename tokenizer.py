@@ -0,0 +1,125 @@
+"""Single-pass line tokenizer shared by the vendor parsers.
+
+Header fields come from module-level compiled patterns (first match in the document;
+labels and values may sit on different lines). Charge lines come from one pass over the
+upper-cased lines: only lines containing one of the caller's marker substrings become
+records, and only those get their numbers parsed.
+"""
+import re
+from bisect import bisect_right
+from itertools import accumulate
+from typing import NamedTuple
+
+import metrics
+
+# Every number, as the parsers have always read them ("125G" -> 125, "1,234.50" -> 1, 234.50)
+NUM = re.compile(r"\d+(?:\.\d+)?")
+NON_DIGIT = re.compile(r"\D")
+
+# Exactly the strings float() accepts (after str.split(), so no surrounding whitespace)
+_DIGITS = r"\d(?:_?\d)*"
+FLOAT_TOKEN = re.compile(
+    rf"[+-]?(?:(?:{_DIGITS}(?:\.(?:{_DIGITS})?)?|\.{_DIGITS})(?:[eE][+-]?{_DIGITS})?"
+    r"|(?i:inf|infinity|nan))"
+)
+# Four float() tokens joined by single spaces: the common plain-decimal shape first, then any float
+_DECIMAL = r"(?:\d+(?:\.\d*)?|\.\d+)"
+_TAIL_PLAIN = re.compile(" ".join([_DECIMAL] * 4))
+_TAIL_ANY = re.compile(" ".join([f"(?:{FLOAT_TOKEN.pattern})"] * 4))
+
+
+_ASCII_NON_DIGITS = bytes(b for b in range(128) if not chr(b).isdigit())
+
+
+def digits_only_fast(s: str) -> str:
+    """NON_DIGIT.sub("", s), using bytes.translate for ASCII text."""
+    if s.isascii():
+        return s.encode("ascii").translate(None, _ASCII_NON_DIGITS).decode("ascii")
+    return NON_DIGIT.sub("", s)
+
+
+class ChargeLine(NamedTuple):
+    index: int     # position in text.splitlines()
+    upper: str     # the line, upper-cased (marker checks)
+    nums: list     # every number on the line (NUM), as matched strings; [] unless requested
+    tail: tuple    # last four whitespace-separated fields as floats when the line has at
+                   # least five fields and those four are numeric; None otherwise or unless requested
+
+
+class Tokens(NamedTuple):
+    fields: dict   # field name -> first captured value, or None
+    lines: list    # ChargeLine records, in document order
+    n_lines: int   # len(text.splitlines())
+
+
+def _numeric_tail(line: str):
+    parts = line.rsplit(None, 4)  # 5 parts <=> at least five fields
+    if len(parts) < 5:
+        return None
+    tail = parts[1:]
+    joined = " ".join(tail)
+    if not (_TAIL_PLAIN.fullmatch(joined) or _TAIL_ANY.fullmatch(joined)):
+        return None
+    return tuple(map(float, tail))
+
+
+# Line boundaries str.splitlines() honours besides "\n"
+_OTHER_BREAKS = ("\r", "\x0b", "\x0c", "\x1c", "\x1d", "\x1e", "\x85", "\u2028", "\u2029")
+
+
+def _hit_positions(up: str, marks: tuple) -> list:
+    hits = []
+    for mark in marks:
+        pos = up.find(mark)
+        while pos != -1:
+            hits.append(pos)
+            pos = up.find(mark, pos + 1)
+    hits.sort()
+    return hits
+
+
+def _marked_lines(text: str, up: str, marks: tuple):
+    """Yields (index, line, upper line) for each line containing any of `marks`, plus the line
+       count, matching text.splitlines(). Lines are located with str.find on the whole text, so
+       unmarked lines are never materialized.
+    """
+    if len(up) != len(text) or any(b in text for b in _OTHER_BREAKS):
+        # rare: upper() changed lengths or exotic line breaks -> split explicitly
+        lines, ups = text.splitlines(), up.splitlines()
+        starts = list(accumulate(map(len, up.splitlines(keepends=True))))
+        found = sorted({bisect_right(starts, pos) for pos in _hit_positions(up, marks)})
+        return [(i, lines[i], ups[i]) for i in found], len(lines)
+
+    n_lines = up.count("\n") + (1 if text and not text.endswith("\n") else 0)
+    out = []
+    index, counted_to, line_end = 0, 0, -1
+    for pos in _hit_positions(up, marks):
+        if pos < line_end:
+            continue  # another marker on a line already taken
+        index += up.count("\n", counted_to, pos)
+        counted_to = pos
+        start = up.rfind("\n", 0, pos) + 1
+        line_end = up.find("\n", pos)
+        if line_end == -1:
+            line_end = len(up)
+        out.append((index, text[start:line_end], up[start:line_end]))
+    return out, n_lines
+
+
+def tokenize(text: str, field_patterns: dict, marks: tuple, nums: bool = False, tail: bool = False) -> Tokens:
+    """`marks` are upper-case substrings selecting charge lines; `nums` / `tail` choose which
+       numeric views of those lines to compute.
+    """
+    fields = {}
+    for name, pattern in field_patterns.items():
+        m = pattern.search(text)
+        fields[name] = m.group(1) if m else None
+
+    marked, n_lines = _marked_lines(text, text.upper(), marks)
+    findall = NUM.findall
+    records = [ChargeLine(i, up, findall(line) if nums else [], _numeric_tail(line) if tail else None)
+               for i, line, up in marked]
+    # one search per header field, plus the per-line number scans on charge lines
+    metrics.incr("regex_passes", len(field_patterns) + len(records) * (nums + tail))
+    metrics.incr("charge_lines", len(records))
+    return Tokens(fields, records, n_lines)
@@ -1,3 +1,4 @@
+import os
 import re
 
 def norm(s: str) -> str:
@@ -6,6 +7,33 @@ def norm(s: str) -> str:
 def digits_only(s: str) -> str:
     return re.sub(r"\D", "", str(s))
 
+def read_bytes(source) -> bytes:
+    """Raw bytes from a path, bytes, or (Streamlit) file-like object."""
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read()
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source.read()
+
+_defaults = {}
+
+def resolve_default(option, factory):
+    """True -> a default `factory()` shared by every caller (None if it cannot be created),
+       False/None -> None, else `option` itself, e.g. a PdfCache or SnapshotStore to use."""
+    if option is True:
+        if factory not in _defaults:
+            try:
+                _defaults[factory] = factory()
+            except OSError:
+                return None
+        return _defaults[factory]
+    return option or None
+
 def make_payload_key(company: str, invoice_no: str, cust_po: str) -> str:
     """Stable key used to save/retrieve overrides per invoice."""
     return f"{str(company).strip()}|{str(invoice_no).strip()}|{str(cust_po).strip()}"
\ No newline at end of file
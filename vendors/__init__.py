@@ -0,0 +1,155 @@
+"""Vendor parser registry.
+
+A carrier is one register() call: its ABNs, its MYOB card name and Consignment Summary
+consignors, the markers of the pages its parser reads and of its charge lines, and the
+parser itself as a "module:function" path. Parser modules are imported on a vendor's first parse, so start-up
+cost does not grow with the vendor list.
+
+Vendors are identified by ABN, in three passes:
+
+1. the VENDOR block: an ABN on one of the ten lines from a line starting "VENDOR", so
+   an invoice showing the buyer's own ABN first still goes to the vendor's parser;
+2. ABN-shaped digit runs following an "ABN" label ("ABN 61 050 197 343",
+   "ABN: 61050197343"), in document order, looked up in the ABN table;
+3. ABNs written any other way (no label, hyphens, line breaks), searched for in the
+   document's digits in registration order.
+"""
+import importlib
+import re
+from itertools import islice
+from dataclasses import dataclass, field
+
+from tokenizer import digits_only_fast
+
+UNKNOWN = "Unknown"
+
+# Lookup tables, kept up to date by register(); constants.py re-exports them
+VENDORS = {}             # company -> Vendor, in registration order
+ABNS = {}                # 11-digit ABN -> company
+CARD_NAMES = {}          # company -> MYOB card name
+COMPANY_CONSIGNORS = {}  # company -> its consignors in the Consignment Summary
+PAGE_KEYWORDS = {}       # company -> upper-case markers of the pages carrying its charge lines
+CHARGE_MARKERS = {}      # company -> {charge type: (upper-case line markers, min numbers on a full line)}
+
+# Case-sensitive on purpose: a literal prefix lets the regex engine skip to each label
+ABN_RUN = re.compile(r"ABN\W{0,3}(\d\d(?:[ \xa0]?\d{3}){3})(?!\d)")
+VENDOR_LABEL = re.compile(r"^[^\S\n]*VENDOR", re.IGNORECASE | re.MULTILINE)
+VENDOR_BLOCK_LINES = 10
+
+
+@dataclass
+class Vendor:
+    company: str
+    abns: tuple
+    parser: object               # "module:function" or a callable, text -> ParsedInvoice
+    card_name: str
+    consignors: list
+    page_keywords: tuple = ()
+    charge_markers: dict = field(default_factory=dict)
+    _parse: object = field(default=None, repr=False)
+
+    def parse(self, text: str):
+        if self._parse is None:
+            if callable(self.parser):
+                self._parse = self.parser
+            else:
+                module, _, name = self.parser.partition(":")
+                self._parse = getattr(importlib.import_module(module), name)
+        return self._parse(text)
+
+
+def register(company: str, abns, parser, card_name: str = None, consignors=(), page_keywords=(),
+             charge_markers=None) -> Vendor:
+    """Adds (or replaces) a vendor. Raises ValueError for a malformed ABN or one that is
+       already registered to another vendor. `charge_markers` lets the fast extraction path
+       tell a complete parse from a partial one (see parsers.charges_parsed).
+    """
+    abns = tuple(digits_only_fast(a) for a in abns)
+    for abn in abns:
+        if len(abn) != 11:
+            raise ValueError(f"ABN for {company} must have 11 digits: {abn!r}")
+        if ABNS.get(abn, company) != company:
+            raise ValueError(f"ABN {abn} is already registered to {ABNS[abn]}")
+    unregister(company)
+    vendor = Vendor(company, abns, parser, card_name or company, list(consignors), tuple(page_keywords),
+                    dict(charge_markers or {}))
+    VENDORS[company] = vendor
+    ABNS.update(dict.fromkeys(abns, company))
+    CARD_NAMES[company] = vendor.card_name
+    COMPANY_CONSIGNORS[company] = vendor.consignors
+    PAGE_KEYWORDS[company] = vendor.page_keywords
+    CHARGE_MARKERS[company] = vendor.charge_markers
+    return vendor
+
+
+def unregister(company: str) -> None:
+    vendor = VENDORS.pop(company, None)
+    if vendor is None:
+        return
+    for abn in vendor.abns:
+        ABNS.pop(abn, None)
+    for table in (CARD_NAMES, COMPANY_CONSIGNORS, PAGE_KEYWORDS, CHARGE_MARKERS):
+        table.pop(company, None)
+
+
+def get(company: str):
+    """The registered Vendor, or None."""
+    return VENDORS.get(company)
+
+
+def _lines_from(text: str, start: int):
+    """Lines of `text` from `start` on, read lazily (the block is only a few lines long)."""
+    while start < len(text):
+        end = text.find("\n", start)
+        if end < 0:
+            end = len(text)
+        yield from text[start:end].splitlines()  # other line breaks, as str.splitlines
+        start = end + 1
+
+
+def _vendor_block(text: str):
+    """Company whose ABN is in a VENDOR block (a whole line of ABN digits, or a labelled ABN
+       on one of its lines), else None.
+    """
+    if "vendor" not in text.lower():  # the case-insensitive regex is slow to rule a document out
+        return None
+    for label in VENDOR_LABEL.finditer(text):
+        block = islice((line for line in _lines_from(text, label.start()) if line.strip()), VENDOR_BLOCK_LINES)
+        for line in block:
+            company = ABNS.get(digits_only_fast(line))
+            if company is None:
+                company = next(filter(None, (ABNS.get(digits_only_fast(m.group(1)))
+                                             for m in ABN_RUN.finditer(line))), None)
+            if company is not None:
+                return company
+    return None
+
+
+def identify(text: str) -> str:
+    """Company whose ABN appears in `text`, else UNKNOWN: the VENDOR block's ABN, else the
+       first labelled ABN in document order, else registered ABNs in registration order.
+    """
+    company = _vendor_block(text)
+    if company is not None:
+        return company
+    for m in ABN_RUN.finditer(text):
+        company = ABNS.get(digits_only_fast(m.group(1)))
+        if company is not None:
+            return company
+    clean = digits_only_fast(text)
+    return next((company for abn, company in ABNS.items() if abn in clean), UNKNOWN)
+
+
+register("FRESHMAX NATIONAL PTY LTD", ["61050197343"], "vendors.valleyfresh:parse",
+         consignors=["Valley Fresh Sydney", "Valley Fresh Melbourne"],
+         page_keywords=("LOGISTIC", "FREIGHT"),
+         charge_markers={"Logistics": (("LOGISTIC",), 4), "Freight": (("FREIGHT",), 4)})
+register("De Luca Banana Marketing", ["45105141553"], "vendors.deluca:parse",
+         card_name="De Luca Banana Marketing Pty Ltd",
+         consignors=["Valley Fresh Brisbane"],
+         page_keywords=("BLUEBERRIES", "TSPT", " DD ", "FREIGHT"),
+         charge_markers={"Logistics": (("BLUEBERRIES",), 5), "Freight": (("TSPT", " DD ", "FREIGHT"), 5)})
+register("Bache Bros Pty Ltd", ["29612732064"], "vendors.bache:parse",
+         consignors=["Bache Bros Warehouse"],
+         page_keywords=("BERRY", "FREIGHT"),
+         charge_markers={"Logistics": (("BERRY",), 6), "Freight": (("FREIGHT",), 1)})
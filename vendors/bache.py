@@ -0,0 +1,46 @@
+"""Bache Bros Pty Ltd invoices."""
+import re
+
+from records import ParsedInvoice
+from tokenizer import tokenize
+
+# PDF text may use NBSP for spaces; \s already covers it, literal spaces are written [ \xa0]
+BACHE_FIELDS = {
+    "invoice_no": re.compile(r"Invoice[ \xa0]Number\s*(?:\n\s*)?([A-Z]{2,5}-\d+)", re.IGNORECASE),
+    "cust_po": re.compile(r"Reference\s*(?:\n\s*)?([A-Za-z0-9\-]+)", re.IGNORECASE),
+}
+BACHE_MARKS = ("BERRY", "FREIGHT")
+BACHE_DATE_LABEL = re.compile(r"Invoice\s+Date", re.IGNORECASE)
+BACHE_DATE = re.compile(r"\d{1,2}\s+[A-Za-z]{3}\s+\d{4}")
+
+def extract_bache_invoice_date(text: str):
+    # Find "Invoice" followed by whitespace then "Date"
+    m = BACHE_DATE_LABEL.search(text)
+    if not m:
+        return None
+
+    # Look shortly after the label to avoid Due Date
+    tail = text[m.end(): m.end() + 150]
+
+    d = BACHE_DATE.search(tail)
+    return d.group(0).replace("\xa0", " ") if d else None
+
+
+def parse(text: str) -> ParsedInvoice:
+    tok = tokenize(text, BACHE_FIELDS, BACHE_MARKS, nums=True)
+    invoice_date = extract_bache_invoice_date(text)
+
+    charges = {}
+    total_trays = 0
+
+    # Blueberry lines: trays are the third number, the line total the last
+    for line in tok.lines:
+        if "BERRY" in line.upper and "BLUE" in line.upper:
+            if len(line.nums) >= 6:
+                total_trays += int(round(float(line.nums[2])))
+                charges["Logistics"] = charges.get("Logistics", 0) + float(line.nums[-1])
+        elif "FREIGHT" in line.upper:
+            if line.nums:
+                charges["Freight"] = charges.get("Freight", 0) + float(line.nums[-1])
+
+    return ParsedInvoice(tok.fields["invoice_no"], tok.fields["cust_po"], invoice_date, charges, total_trays)
@@ -0,0 +1,40 @@
+"""De Luca Banana Marketing tax invoices."""
+import re
+
+from records import ParsedInvoice
+from tokenizer import tokenize
+
+DELUCA_FIELDS = {
+    "invoice_no": re.compile(r"Tax Invoice No[: ]+(\d+)", re.IGNORECASE),
+    "cust_po": re.compile(r"Cust(?:omer)?\s*Order\s*No.*?\n([A-Za-z0-9\-]+)", re.IGNORECASE),
+    "invoice_date": re.compile(r"Date\s+(\d{1,2}/\d{1,2}/\d{4})", re.IGNORECASE),
+}
+DELUCA_MARKS = ("BLUEBERRIES", "TSPT", "DD", "FREIGHT")
+
+def parse(text: str) -> ParsedInvoice:
+    tok = tokenize(text, DELUCA_FIELDS, DELUCA_MARKS, nums=True)
+    cust_po = tok.fields["cust_po"]
+    cust_po = cust_po.split("-")[0] if cust_po is not None else None
+
+    total_trays = 0
+    logistics_ex = 0
+    freight_ex = 0
+
+    # "... qty price amount_ex gst amount_inc": amount ex GST is third from the end
+    for line in tok.lines:
+        if len(line.nums) < 5:
+            continue
+        up = line.upper
+        if "BLUEBERRIES" in up:
+            logistics_ex += float(line.nums[-3])
+            total_trays += int(round(float(line.nums[-5])))
+        elif "TSPT" in up or " DD " in f" {up} " or "FREIGHT" in up:
+            freight_ex += float(line.nums[-3])
+
+    charges = {}
+    if logistics_ex:
+        charges["Logistics"] = round(logistics_ex, 2)
+    if freight_ex:
+        charges["Freight"] = round(freight_ex, 2)
+
+    return ParsedInvoice(tok.fields["invoice_no"], cust_po, tok.fields["invoice_date"], charges, total_trays)
@@ -0,0 +1,39 @@
+"""Valley Fresh (FRESHMAX NATIONAL PTY LTD) tax invoices."""
+import math
+import re
+
+from records import ParsedInvoice
+from tokenizer import tokenize
+
+VALLEYFRESH_FIELDS = {
+    "invoice_no": re.compile(r"TAX INVOICE\s+(\d+)", re.IGNORECASE),
+    "cust_po": re.compile(r"Cust\.?\s*Ord(?:er)?\s*No\.?\s*:?[\s]*([A-Za-z0-9\-]+)", re.IGNORECASE),
+    "invoice_date": re.compile(r"Date\s*[: ]\s*(\d{1,2}/\d{1,2}/\d{4})", re.IGNORECASE),
+}
+VALLEYFRESH_MARKS = ("FREIGHT", "LOGISTIC")
+
+def parse(text: str) -> ParsedInvoice:
+    tok = tokenize(text, VALLEYFRESH_FIELDS, VALLEYFRESH_MARKS, tail=True)
+    cust_po = tok.fields["cust_po"]
+    cust_po = cust_po.split("-")[0] if cust_po is not None else None
+
+    total_trays = 0
+    charges = {"Logistics": 0.0, "Freight": 0.0}
+
+    # Charge lines end in "qty price tax amount"; the document's last line is never one
+    for line in tok.lines:
+        if line.tail is None or line.index >= tok.n_lines - 1:
+            continue
+        qty, _price, _tax, amt = line.tail
+        if "FREIGHT" in line.upper:
+            charges["Freight"] += amt
+        elif "LOGISTIC" in line.upper:
+            # Logistics line also carries the product qty (= trays)
+            charges["Logistics"] += amt
+            if math.isfinite(qty):
+                total_trays += int(round(qty))
+
+    # Clean empty charges
+    charges = {k: v for k, v in charges.items() if v}
+
+    return ParsedInvoice(tok.fields["invoice_no"], cust_po, tok.fields["invoice_date"], charges, total_trays)
@@ -0,0 +1,313 @@
+"""Watch-folder daemon: PDFs dropped into an inbox are exported within seconds.
+
+    python -m watcher INBOX --consignment summary.xlsx --maps maps.xlsx \
+        [--outbox DIR] [--queue DIR] [--interval 1] [--settle 2] [--no-cache] \
+        [--ledger PATH | --no-ledger] [--once]
+
+The inbox is polled with one os.scandir() per interval. A PDF is picked up once its size
+and mtime have held for --settle seconds, since mail clients write attachments in pieces.
+It then goes through the app's path (parse_pdf_bytes, the consignment lookup, allocate)
+against workbook indexes that stay loaded, and are rebuilt only when a workbook changes.
+
+Exported invoices are appended to the day's rolling import file,
+OUTBOX/myob_import_YYYY-MM-DD.txt, which the ledger records as one export. Their PDFs
+move to INBOX/processed/. Failed invoices go to the review queue (default INBOX/review/):
+the PDF plus a JSON note of why it failed. The app opens the queue in its fix panel when
+INVOICESPLIT_REVIEW_QUEUE points at it.
+
+Errors do not stop the daemon. A PDF that cannot be processed is logged and queued for
+review, and a workbook that cannot be reloaded (mid-save, missing) is logged while the
+previous indexes stay in use until it is readable again.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from datetime import date, datetime
+
+import metrics
+import vendors
+from allocator import AccountMap
+from excel_ops import ConsignmentIndex
+from exporter import iter_tab_delimited_with_header
+from ledger import Ledger
+from parsers import parse_pdf_bytes
+from pdf_cache import content_hash
+from pipeline import check_ledger, process_invoice
+from records import FailedInvoice, FailReason, ParsedInvoice
+from utils import read_bytes
+
+
+def _move(path: str, folder: str) -> str:
+    """Moves `path` into `folder` without overwriting; returns the new path."""
+    os.makedirs(folder, exist_ok=True)
+    stem, ext = os.path.splitext(os.path.basename(path))
+    dest, n = os.path.join(folder, stem + ext), 1
+    while os.path.exists(dest):
+        dest, n = os.path.join(folder, f"{stem}-{n}{ext}"), n + 1
+    os.replace(path, dest)
+    return dest
+
+
+class QueuedPdf:
+    """A review-queue PDF shaped like a Streamlit upload (name, size, getvalue())."""
+
+    def __init__(self, path: str, note: dict):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+        self.note = note
+
+    def getvalue(self) -> bytes:
+        return read_bytes(self.path)
+
+
+class ReviewQueue:
+    """Failed invoices awaiting a person: NAME.pdf with NAME.pdf.json (why it failed)
+       alongside, plus workbooks.json naming the workbooks the daemon matched against.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def add(self, path: str, failure) -> str:
+        dest = _move(path, self.root)
+        note = {"reason": failure.reason.value, "message": failure.message, "company": failure.company,
+                "invoice_no": failure.invoice_no, "cust_po": failure.cust_po,
+                "queued_at": datetime.now().isoformat(timespec="seconds")}
+        with open(dest + ".json", "w", encoding="utf-8") as f:
+            json.dump(note, f)
+        return dest
+
+    def items(self) -> list:
+        """QueuedPdf per queued invoice, oldest first."""
+        out = []
+        with os.scandir(self.root) as it:
+            entries = sorted((e for e in it if e.is_file() and e.name.lower().endswith(".pdf")),
+                             key=lambda e: e.stat().st_mtime)
+        for e in entries:
+            try:
+                with open(e.path + ".json", "r", encoding="utf-8") as f:
+                    note = json.load(f)
+            except (OSError, ValueError):
+                note = {}
+            out.append(QueuedPdf(e.path, note))
+        return out
+
+    def remove(self, names) -> None:
+        """Drops resolved invoices (by PDF file name) from the queue."""
+        for name in names:
+            for path in (os.path.join(self.root, name), os.path.join(self.root, name + ".json")):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def set_workbooks(self, consignment: str, maps: str) -> None:
+        with open(os.path.join(self.root, "workbooks.json"), "w", encoding="utf-8") as f:
+            json.dump({"consignment": os.path.abspath(consignment), "maps": os.path.abspath(maps)}, f)
+
+    def workbooks(self):
+        """(consignment, maps) paths last used by the daemon, or None."""
+        try:
+            with open(os.path.join(self.root, "workbooks.json"), "r", encoding="utf-8") as f:
+                paths = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return paths["consignment"], paths["maps"]
+
+
+class RollingExport:
+    """The day's MYOB import file, appended to one invoice at a time. With a ledger, each
+       file is one export whose invoices are added as they are written.
+    """
+
+    def __init__(self, outbox: str, ledger: Ledger = None):
+        self.outbox = outbox
+        self.ledger = ledger
+        os.makedirs(outbox, exist_ok=True)
+
+    def path(self, day: date = None) -> str:
+        return os.path.join(self.outbox, f"myob_import_{(day or date.today()).isoformat()}.txt")
+
+    def append(self, invoice: dict, lines) -> str:
+        """Writes one invoice's AllocationLines (and its blank separator line); returns the file.
+           Number formats follow this invoice's own columns (exporter.numeric_columns), since
+           lines already in the file cannot be rewritten.
+        """
+        path = self.path()
+        fresh = not os.path.exists(path) or os.path.getsize(path) == 0
+        with open(path, "a", encoding="utf-8", newline="") as f:
+            f.write("".join(iter_tab_delimited_with_header([lines], header=fresh)))
+        if self.ledger is not None:
+            label = os.path.abspath(path)
+            self.ledger.record_export([invoice], [lines], label, self.ledger.find_export(label))
+        return path
+
+
+class Watcher:
+    def __init__(self, inbox: str, consignment: str, maps: str, outbox: str = None, queue: str = None,
+                 ledger: Ledger = None, settle: float = 2.0, cache=True):
+        self.inbox = inbox
+        self.consignment, self.maps = consignment, maps
+        self.settle = settle
+        self.cache = cache
+        self.ledger = ledger
+        self.rolling = RollingExport(outbox or os.path.join(inbox, "outbox"), ledger)
+        self.queue = ReviewQueue(queue or os.path.join(inbox, "review"))
+        self.processed = os.path.join(inbox, "processed")
+        self._pending = {}   # file name -> (size, mtime_ns, time first seen with that stat)
+        self._stamp = None   # workbooks' (size, mtime_ns) the indexes were built from
+        self._indexes = None
+        self._error = None   # last workbook error reported, so it is logged once
+
+    def indexes(self):
+        """(cons_index, account_map), rebuilt only when either workbook changed on disk.
+           A workbook that cannot be used (missing, half-saved, conflicting mappings) raises on
+           first load; on a reload the previous indexes are kept and the error is reported,
+           and the load is retried once the workbook changes again.
+        """
+        try:
+            stamp = tuple((st.st_size, st.st_mtime_ns) for st in map(os.stat, (self.consignment, self.maps)))
+            if stamp != self._stamp:
+                self._stamp = stamp
+                self._indexes = (ConsignmentIndex.from_excel(self.consignment, snapshot=self.cache),
+                                 AccountMap.from_excel(self.maps))
+                self.queue.set_workbooks(self.consignment, self.maps)
+                self._error = None
+                print(f"workbooks loaded: {self.consignment}, {self.maps}", flush=True)
+        except Exception as e:
+            if self._indexes is None:
+                raise
+            message = f"{type(e).__name__}: {e}"
+            if message != self._error:
+                self._error = message
+                print(f"error: keeping the previous workbooks: {message}", file=sys.stderr, flush=True)
+        return self._indexes
+
+    def ready(self, now: float = None) -> list:
+        """Inbox PDFs whose size and mtime have not changed for `settle` seconds, oldest first."""
+        now = time.monotonic() if now is None else now
+        seen, out = {}, []
+        with os.scandir(self.inbox) as it:
+            for e in it:
+                if not (e.is_file() and e.name.lower().endswith(".pdf")):
+                    continue
+                st = e.stat()
+                size, mtime, since = self._pending.get(e.name, (None, None, now))
+                if (size, mtime) != (st.st_size, st.st_mtime_ns):
+                    since = now  # new or still being written
+                seen[e.name] = (st.st_size, st.st_mtime_ns, since)
+                if now - since >= self.settle:
+                    out.append((st.st_mtime_ns, e.path))
+        self._pending = seen
+        return [path for _, path in sorted(out)]
+
+    def process(self, path: str):
+        """Exports or queues one PDF. Returns (lines, failure) as pipeline.process_invoice."""
+        name = os.path.basename(path)
+        cons_index, account_map = self.indexes()
+        with metrics.timer("watch_invoice"):
+            data = read_bytes(path)
+            digest = content_hash(data)
+            parse_error = None
+            try:
+                company, parsed = parse_pdf_bytes(data, cache=self.cache)
+            except Exception as e:
+                company, parsed, parse_error = vendors.UNKNOWN, ParsedInvoice.empty(), f"{type(e).__name__}: {e}"
+            failure = check_ledger(self.ledger, company, parsed, name, digest)
+            lines = []
+            if failure is None:
+                lines, failure = process_invoice(company, parsed, cons_index, account_map, name, parse_error)
+            if failure is not None:
+                self.queue.add(path, failure)
+            else:
+                invoice = dict(company=company, invoice_no=parsed.invoice_no, cust_po=parsed.cust_po,
+                               source=name, content_hash=digest)
+                out = self.rolling.append(invoice, lines)
+                _move(path, self.processed)
+        self._pending.pop(name, None)
+        if failure is not None:
+            metrics.incr("watch_invoices", result="queued")
+            print(f"{name}: {failure.message} -> review queue", flush=True)
+        else:
+            metrics.incr("watch_invoices", result="exported")
+            print(f"{name}: {len(lines)} MYOB lines -> {out}", flush=True)
+        return lines, failure
+
+    def _quarantine(self, path: str, error: Exception) -> None:
+        """Queues a PDF whose processing raised, so it is neither retried forever nor lost."""
+        name = os.path.basename(path)
+        message = f"Could not process {name} ({type(error).__name__}: {error})"
+        print(f"error: {message}", file=sys.stderr, flush=True)
+        metrics.incr("watch_invoices", result="error")
+        self._pending.pop(name, None)
+        if os.path.exists(path):
+            try:
+                self.queue.add(path, FailedInvoice(FailReason.ERROR, message, vendors.UNKNOWN, None, None,
+                                                   None, {}, name))
+            except OSError as e:
+                print(f"error: could not queue {name}: {e}", file=sys.stderr, flush=True)
+
+    def poll(self) -> int:
+        """Processes every settled PDF; returns how many. A PDF that raises is queued for review."""
+        self.indexes()
+        paths = self.ready()
+        for path in paths:
+            try:
+                self.process(path)
+            except Exception as e:
+                self._quarantine(path, e)
+        return len(paths)
+
+    def run(self, interval: float = 1.0, stop: threading.Event = None) -> None:
+        stop = stop or threading.Event()
+        self.indexes()
+        while not stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:  # e.g. the inbox briefly unavailable; try again next interval
+                print(f"error: {type(e).__name__}: {e}", file=sys.stderr, flush=True)
+            stop.wait(interval)
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="watcher", description="Export invoices dropped into an inbox folder.")
+    ap.add_argument("inbox", help="folder to watch for PDF invoices")
+    ap.add_argument("--consignment", required=True, help="Consignment Summary workbook (.xlsx)")
+    ap.add_argument("--maps", required=True, help="Account Maps workbook (.xlsx)")
+    ap.add_argument("--outbox", default=None, help="folder for the daily import files (default: INBOX/outbox)")
+    ap.add_argument("--queue", default=None, help="review queue folder (default: INBOX/review)")
+    ap.add_argument("--interval", type=float, default=1.0, help="seconds between inbox scans")
+    ap.add_argument("--settle", type=float, default=2.0, help="seconds a PDF must be unchanged before it is read")
+    ap.add_argument("--no-cache", action="store_true", help="skip the parsed-PDF cache and consignment snapshot")
+    ap.add_argument("--ledger", default=None, help="export ledger file (default: ~/.local/share/invoicesplit/ledger.sqlite3)")
+    ap.add_argument("--no-ledger", action="store_true", help="neither check nor record exported invoices")
+    ap.add_argument("--once", action="store_true", help="process what is in the inbox now, then exit")
+    args = ap.parse_args(argv)
+
+    watcher = Watcher(args.inbox, args.consignment, args.maps, args.outbox, args.queue,
+                      None if args.no_ledger else Ledger(args.ledger), args.settle, not args.no_cache)
+    try:
+        if args.once:
+            watcher.settle = 0
+            watcher.indexes()
+            watcher.poll()
+            return 0
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())  # finish the current invoice, then exit
+        print(f"watching {os.path.abspath(args.inbox)}", flush=True)
+        watcher.run(args.interval, stop)
+    except Exception as e:  # workbooks unusable at start-up, e.g. missing or conflicting account mappings
+        print(f"error: {type(e).__name__}: {e}", file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())